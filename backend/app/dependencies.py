@@ -1,13 +1,39 @@
+import os
 import tempfile
 from pathlib import Path
 
-from .services import DemService, DroneService, RecordService, StreamService
+from fastapi import HTTPException
+
+from .services import (
+    DemService,
+    DroneService,
+    H264Relay,
+    ImageService,
+    JobService,
+    RecordService,
+    StreamService,
+)
 
 _dem_service = DemService()
-_record_service = RecordService()
+# 设置 DEM_VIDEO_PASSTHROUGH=1 时直接录制与转发无人机的 H.264 码流，不做重编码
+_h264_relay = H264Relay() if os.environ.get("DEM_VIDEO_PASSTHROUGH") == "1" else None
+_record_service = RecordService(relay=_h264_relay)
+_job_service = JobService()
+_image_service: ImageService | None = None
 _drone_service: DroneService | None = None
 _stream_service: StreamService | None = None
 
+
+def shutdown():
+    """应用关闭时停止后台线程，写完最后一个录制分段，结束处理作业"""
+    if _stream_service is not None:
+        _stream_service.is_streaming = False
+    _record_service.stop_recording()
+    if _h264_relay is not None:
+        _h264_relay.stop()
+    _job_service.shutdown()
+
+
 def get_drone_service():
     global _drone_service  # noqa: PLW0603
     if _drone_service is None:
@@ -18,13 +44,78 @@ def get_drone_service():
 def get_stream_service():
     global _stream_service  # noqa: PLW0603
     if _stream_service is None:
-        _stream_service = StreamService(get_drone_service(), _record_service)
+        _stream_service = StreamService(
+            get_drone_service(), _record_service, relay=_h264_relay
+        )
     return _stream_service
 
-def get_dem_service():
-    return _dem_service
+
+def get_image_service():
+    global _image_service  # noqa: PLW0603
+    if _image_service is None:
+        _image_service = ImageService(gettempdir() / "cache" / "thumbnails")
+    return _image_service
+
+
+def get_job_service():
+    return _job_service
+
+
+def get_dem_service(job_id: str | None = None):
+    """
+    返回指定作业的 DEM 结果；未指定时返回最近完成的作业
+    """
+    job_id = job_id or _job_service.latest_job_id
+    if job_id is None:
+        return _dem_service
+    dem_service = _job_service.get_dem_service(job_id)
+    if dem_service is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} has no DEM result")
+    return dem_service
+
 
 def gettempdir():
     temp_dir = Path(tempfile.gettempdir()) / "dem"
     temp_dir.mkdir(parents=True, exist_ok=True)
     return temp_dir
+
+
+def get_live_dir():
+    """飞行中实时抽取关键帧的工作目录"""
+    return gettempdir() / "live"
+
+
+def get_work_dir(job_id: str | None = None):
+    """
+    返回作业的工作目录（图片、点云与 DEM）；未指定时为最近完成的作业，
+    没有作业时为临时目录
+    """
+    job_id = job_id or _job_service.latest_job_id
+    if job_id is None:
+        return gettempdir()
+    work_dir = _job_service.work_dir(job_id)
+    if not work_dir.is_dir():
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return work_dir
+
+
+def get_image_dir(job_id: str | None = None):
+    """
+    返回图片所在的工作目录；未指定作业时为实时抽帧目录与最近完成的作业中较新的一个，
+    实时抽帧目录只有图片，点云与 DEM 使用 get_work_dir
+    """
+    live_dir = get_live_dir()
+    if job_id is None and _stream_service is not None and _stream_service.ingest:
+        return live_dir
+    live_images = live_dir / "images"
+    if job_id is None and live_images.is_dir():
+        latest = _job_service.latest_job_id
+        if latest is None:
+            return live_dir
+        work_dir = _job_service.work_dir(latest)
+        if (
+            not work_dir.is_dir()
+            or live_images.stat().st_mtime > work_dir.stat().st_mtime
+        ):
+            return live_dir
+    return get_work_dir(job_id)
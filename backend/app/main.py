@@ -1,9 +1,20 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .routers import drone, image, process, websockets
+from .dependencies import shutdown
+from .routers import drone, image, jobs, process, websockets
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await asyncio.to_thread(shutdown)
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,5 +29,6 @@ app.add_middleware(
 )
 app.include_router(drone.router)
 app.include_router(image.router)
+app.include_router(jobs.router)
 app.include_router(process.router)
 app.include_router(websockets.router)
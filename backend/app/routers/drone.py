@@ -36,3 +36,9 @@ async def send_drone_command(
         await drone_service.execute_command(command)
     except Exception as e:
         return {"message": f"Failed to send command to drone: {str(e)}"}
+
+
+@router.get("/control/stats")
+async def get_control_stats(drone_service: DroneService = Depends(get_drone_service)):
+    """控制线程的发送频率、按键到发送的延迟与抖动统计"""
+    return drone_service.control_stats()
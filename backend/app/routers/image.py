@@ -1,37 +1,159 @@
+import base64
+import hashlib
 from pathlib import Path
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response
+from pydantic import BaseModel, Field
 
-from ..dependencies import gettempdir
+from ..dependencies import (
+    get_image_dir,
+    get_image_service,
+    get_live_dir,
+    get_stream_service,
+)
+from ..services import (
+    ImageEntry,
+    ImageService,
+    ImageSize,
+    KeyframeConfig,
+    StreamService,
+)
 
 router = APIRouter(
     prefix="/api/image",
     tags=["image"],
 )
 
-def get_image_files(tempdir: Path = Depends(gettempdir)):
-    image_dir = tempdir / "images"
-    if not image_dir.is_dir():
-        return []
-    # Sort files to ensure consistent order
-    files = sorted([f for f in image_dir.iterdir() if f.is_file()])
-    return files
+# 一次范围查询最多返回的图片数
+MAX_PAGE = 200
+# 请求带有与当前版本一致的 v 参数时，内容不会再变化，可长期缓存
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+class ImageQuery(BaseModel):
+    """单张图片按 id 查询，或按 from/to 范围分页；size 为图片尺寸，v 为图片版本"""
+
+    id: int | None = None
+    first: int | None = Field(default=None, alias="from")
+    last: int | None = Field(default=None, alias="to")
+    size: ImageSize = "full"
+    v: str | None = None
+
+def get_image_files(
+    work_dir: Path = Depends(get_image_dir),
+    image_service: ImageService = Depends(get_image_service),
+):
+    # 按文件名排序的图片索引，目录未变化时不重新扫描
+    return image_service.images(work_dir / "images")
 
 @router.get("/number")
-async def get_image_number(image_files: list[Path] = Depends(get_image_files)):
+async def get_image_number(image_files: list[ImageEntry] = Depends(get_image_files)):
     """
     Get the total number of images.
     """
     return {"number": len(image_files)}
 
+def read_page(
+    image_service: ImageService, page: list[ImageEntry], size: ImageSize, first: int
+):
+    """在线程池中读取一页缩略图，size=full 时只返回元信息"""
+    images = []
+    for offset, entry in enumerate(page):
+        item = {
+            "id": first + offset,
+            "name": entry.path.name,
+            "version": entry.version,
+            "url": f"/api/image?id={first + offset}&size={size}&v={entry.version}",
+        }
+        if size != "full":
+            data = image_service.thumbnail(entry, size).read_bytes()
+            item["data"] = base64.b64encode(data).decode()
+        images.append(item)
+    return images
+
 @router.get("")
-async def get_image(id: int, image_files: list[Path] = Depends(get_image_files)):
+async def get_image(
+    query: Annotated[ImageQuery, Query()],
+    if_none_match: str | None = Header(default=None),
+    image_files: list[ImageEntry] = Depends(get_image_files),
+    image_service: ImageService = Depends(get_image_service),
+):
     """
-    Get an image by its ID (1-based index).
+    Get an image by its ID (1-based index), or a page of images with from/to
+    (inclusive, at most MAX_PAGE). size=thumb/preview returns cached thumbnails;
+    pages embed them as base64 JPEG.
     """
+    id, first, size = query.id, query.first, query.size
+    if id is None:
+        if first is None:
+            raise HTTPException(status_code=400, detail="Either id or from is required")
+        last = min(
+            query.last or first + MAX_PAGE - 1, first + MAX_PAGE - 1, len(image_files)
+        )
+        if not 1 <= first <= last:
+            raise HTTPException(status_code=404, detail="Image not found")
+        page = image_files[first - 1 : last]
+        digest = hashlib.blake2b(f"{len(image_files)}".encode(), digest_size=16)
+        for entry in page:
+            digest.update(f"{entry.path.name}:{entry.version}".encode())
+        etag = f'"{first}-{size}-{digest.hexdigest()}"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        try:
+            images = await run_in_threadpool(
+                read_page, image_service, page, size, first
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        content = {
+            "number": len(image_files),
+            "from": first,
+            "to": last,
+            "images": images,
+        }
+        return JSONResponse(
+            content,
+            headers={"ETag": etag, "Cache-Control": "no-cache"},
+        )
+
     if not image_files or not 1 <= id <= len(image_files):
         raise HTTPException(status_code=404, detail="Image not found")
-    
-    image_path = image_files[id - 1]
-    return FileResponse(image_path)
\ No newline at end of file
+
+    entry = image_files[id - 1]
+    # 版本只由文件修改时间与大小构成，加入文件名区分不同图片
+    digest = hashlib.blake2b(
+        f"{entry.path.name}:{entry.version}".encode(), digest_size=16
+    )
+    etag = f'"{digest.hexdigest()}-{size}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE if query.v == entry.version else "no-cache",
+    }
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        image_path = await run_in_threadpool(image_service.thumbnail, entry, size)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    return FileResponse(image_path, headers=headers)
+
+@router.post("/live/start")
+async def start_live_ingest(
+    keyframes: KeyframeConfig = KeyframeConfig(),
+    stream_service: StreamService = Depends(get_stream_service),
+):
+    """
+    开始在飞行中实时抽取关键帧，抽取期间 /number 返回已写入的关键帧数
+    """
+    await stream_service.start_ingest(get_live_dir() / "images", keyframes)
+    return {"message": "Live keyframe ingestion started."}
+
+@router.post("/live/stop")
+async def stop_live_ingest(stream_service: StreamService = Depends(get_stream_service)):
+    """
+    停止实时抽取并写入最后一个关键帧，之后可用 path="Live" 处理这些图片
+    """
+    await stream_service.stop_ingest()
+    return {"message": "Live keyframe ingestion stopped."}
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..dependencies import get_job_service
+from ..services import JobInfo, JobService
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+
+@router.get("")
+async def list_jobs(
+    job_service: JobService = Depends(get_job_service),
+) -> list[JobInfo]:
+    """列出所有DEM处理作业"""
+    return job_service.list()
+
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: str, job_service: JobService = Depends(get_job_service)
+) -> JobInfo:
+    """查询作业状态与阶段进度"""
+    info = job_service.status(job_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return info
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str, job_service: JobService = Depends(get_job_service)):
+    """取消作业，运行中的作业在下一个阶段检查点停止"""
+    if not job_service.cancel(job_id):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return {"message": f"Job {job_id} cancellation requested."}
@@ -1,20 +1,48 @@
+import functools
 import os
 import shutil
 from pathlib import Path
+from typing import Annotated, Literal
 
-import cv2
 import numpy as np
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
+    Header,
     HTTPException,
 )
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
 
-from ..dependencies import get_dem_service, gettempdir
-from ..services import DemConfig, DemService, PlyService
+from ..dependencies import (
+    get_dem_service,
+    get_job_service,
+    get_live_dir,
+    get_stream_service,
+    get_work_dir,
+    gettempdir,
+)
+from ..services import (
+    Compression,
+    DemConfig,
+    DemService,
+    ElevationDtype,
+    ExportOptions,
+    FeatureConfig,
+    JobProgress,
+    JobService,
+    KeyframeConfig,
+    PlyService,
+    StreamService,
+    compress,
+    encode_dem_binary,
+    extract_keyframes,
+    extract_recording_keyframes,
+    is_recording_dir,
+    load_pointcloud_lod,
+    source_stamp,
+)
 
 router = APIRouter(prefix="/api", tags=["process"])
 
@@ -22,31 +50,94 @@ router = APIRouter(prefix="/api", tags=["process"])
 class ProcessRequest(BaseModel):
     path: str
     config: DemConfig
+    keyframes: KeyframeConfig = KeyframeConfig()
+    features: FeatureConfig = FeatureConfig()
+
 
+@functools.cache
+def _pipeline_dem_service():
+    """工作进程内复用的 DemService，保留已读取的点云与 KD 树"""
+    return DemService()
 
-def process_pipeline(config: DemConfig, dem_service: DemService, temp_dir: Path):
-    """处理DEM的管道函数"""
-    ply_service = PlyService(temp_dir)
+
+def process_pipeline(request: ProcessRequest, work_dir: Path, progress: JobProgress):
+    """
+    处理DEM的管道函数，在作业进程池中运行，结果写入作业目录
+    request.path 为已检查过的图片文件夹或视频文件路径
+    """
+    config = request.config
+    progress("ingest")
+    handle_images(request.path, work_dir, request.keyframes)
+    progress("reconstruction")
+    ply_service = PlyService(work_dir, request.features)
     ply_service()
-    dem_service.generate_dem(str(temp_dir / "fused.ply"), config)
+    link_pointcloud(work_dir)
+    # 预先构建点云 LOD，查看器首次访问时无需等待
+    load_pointcloud_lod(work_dir)
+    dem_service = _pipeline_dem_service()
+    if config.streaming:
+        dem_service.generate_dem_streaming(
+            str(work_dir / "fused.ply"), config, str(work_dir / "dem.tif"), progress
+        )
+        # 完整分辨率的结果在 dem.tif 中，抽稀后的预览供 /dem 与瓦片接口使用
+        dem_service.load_geotiff(work_dir / "dem.tif")
+    else:
+        dem_service.generate_dem(str(work_dir / "fused.ply"), config, progress)
+    dem_service.save_result(work_dir / "result.npz")
 
 
-def handle_images(path: str, temp_dir: Path):
-    """保存上传的图片到临时文件夹"""
-    image_dir = temp_dir / "images"
-    image_dir.mkdir(parents=True, exist_ok=True)
-    # 清除之前的图片
-    for existing_file in image_dir.glob("*"):
-        if existing_file.is_file():
-            existing_file.unlink()
+def link_pointcloud(work_dir: Path):
+    """
+    重建未生成点云时，使用放在临时目录中的外部点云 <tmp>/dem/fused.ply，
+    链接（不支持时复制）到作业目录
+    """
+    ply_path = work_dir / "fused.ply"
+    if ply_path.exists():
+        return
+    shared = gettempdir() / "fused.ply"
+    if not shared.exists():
+        raise FileNotFoundError(
+            f"No point cloud: reconstruction produced no {ply_path} "
+            f"and {shared} does not exist"
+        )
+    try:
+        os.link(shared, ply_path)
+    except OSError:
+        shutil.copyfile(shared, ply_path)
+
 
+def resolve_source(path: str, temp_dir: Path):
+    """检查输入路径，返回图片文件夹或视频文件的路径"""
     if path == "Default":
-        path = str(temp_dir / "record.avi")
+        # 最近一次的分段录制
+        path = str(temp_dir / "record")
+    elif path == "Live":
+        # 飞行中实时抽取的关键帧
+        path = str(get_live_dir() / "images")
 
     # 检测path为文件夹还是文件
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail=f"Path {path} does not exist")
-    if os.path.isdir(path):
+    if not os.path.isdir(path) and not (
+        os.path.isfile(path) and path.lower().endswith((".mp4", ".avi", ".mov", ".mkv"))
+    ):
+        raise HTTPException(status_code=400, detail=f"Unsupported path type: {path}")
+    return path
+
+
+def handle_images(path: str, work_dir: Path, keyframes: KeyframeConfig):
+    """保存上传的图片到作业目录"""
+    image_dir = work_dir / "images"
+    image_dir.mkdir(parents=True, exist_ok=True)
+    # 清除之前的图片
+    for existing_file in image_dir.glob("*"):
+        if existing_file.is_file():
+            existing_file.unlink()
+
+    if is_recording_dir(Path(path)):
+        # 分段录制：按索引并行抽取各分段的关键帧
+        extract_recording_keyframes(Path(path), image_dir, keyframes)
+    elif os.path.isdir(path):
         # 将图片文件移动到image_dir
         for image_file in os.listdir(path):
             image = Path(path) / image_file
@@ -60,41 +151,32 @@ def handle_images(path: str, temp_dir: Path):
                 filename = f"{image.stem}_{image.stat().st_mtime_ns}{file_extension}"
                 new_file_path = image_dir / filename
                 shutil.copy(image, new_file_path)
-    # 如果是视频文件，每秒截取一帧保存到 image_dir
-    elif os.path.isfile(path) and path.lower().endswith((".mp4", ".avi", ".mov")):
-        cap = cv2.VideoCapture(path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_interval = int(fps)
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if frame_count % frame_interval == 0:
-                # 生成新的文件名（保持原扩展名）
-                filename = f"frame_{frame_count:08d}.jpg"
-                file_path = image_dir / filename
-                cv2.imwrite(str(file_path), frame)
-            frame_count += 1
-
-        cap.release()
+    # 如果是视频文件，按清晰度与位移抽取关键帧保存到 image_dir
     else:
-        raise HTTPException(status_code=400, detail=f"Unsupported path type: {path}")
+        extract_keyframes(path, image_dir, keyframes)
+    # 更新目录修改时间，使图片索引在写入完成后重新扫描
+    os.utime(image_dir)
 
 
 @router.post("/process")
 async def process_dem(
     request_data: ProcessRequest,
-    background_tasks: BackgroundTasks,
-    dem_service: DemService = Depends(get_dem_service),
+    job_service: JobService = Depends(get_job_service),
+    stream_service: StreamService = Depends(get_stream_service),
     temp_dir: Path = Depends(gettempdir),
 ):
     try:
-        handle_images(request_data.path, temp_dir)
-        background_tasks.add_task(
-            process_pipeline, request_data.config, dem_service, temp_dir
+        if request_data.path == "Live":
+            # 写入最后一个关键帧后再开始处理
+            await stream_service.stop_ingest()
+        source = resolve_source(request_data.path, temp_dir)
+        job_id = job_service.submit(
+            process_pipeline, request_data.model_copy(update={"path": source})
         )
-        return {"message": "DEM processing started in the background."}
+        return {
+            "message": "DEM processing started in the background.",
+            "job_id": job_id,
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -105,37 +187,129 @@ async def process_dem(
 
 # 点云数据路由
 @router.get("/pointcloud")
-async def get_pointcloud(temp_dir: Path = Depends(gettempdir)):
+async def get_pointcloud(
+    if_none_match: str | None = Header(default=None),
+    work_dir: Path = Depends(get_work_dir),
+):
     """
-    返回PLY点云文件
+    返回PLY点云文件，支持 Range 分段下载；文件未变化时返回 304
     """
     # 获取PLY文件路径
-    ply_file_path = temp_dir / "fused.ply"
+    ply_file_path = work_dir / "fused.ply"
 
     # 检查文件是否存在
     if not os.path.exists(ply_file_path):
         raise HTTPException(status_code=404, detail="PLY文件未找到")
 
-    # 返回文件响应，设置正确的MIME类型
+    etag = f'"{source_stamp(ply_file_path)}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    # 返回文件响应，设置正确的MIME类型；no-cache 表示每次用 ETag 重新验证
     return FileResponse(
         path=ply_file_path,
         media_type="application/octet-stream",
         filename="fused.ply",
         headers={
             "Content-Disposition": "attachment; filename=fused.ply",
-            "Cache-Control": "no-cache",  # 防止缓存问题
+            "Cache-Control": "no-cache",
+            "ETag": etag,
         },
     )
 
 
+@router.get("/pointcloud/nodes")
+async def get_pointcloud_nodes(work_dir: Path = Depends(get_work_dir)):
+    """
+    返回点云八叉树 LOD 的层次信息，首次访问或点云更新后会先构建 LOD
+    节点编号 "r" 为根节点，子节点在父节点编号后追加 0~7
+    """
+    if not (work_dir / "fused.ply").exists():
+        raise HTTPException(status_code=404, detail="PLY文件未找到")
+    try:
+        lod = await run_in_threadpool(load_pointcloud_lod, work_dir)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"构建点云LOD时出错: {str(e)}")
+    return lod.hierarchy
+
+
+@router.get("/pointcloud/nodes/{node_id}")
+async def get_pointcloud_node(
+    node_id: str,
+    compression: Compression = "none",
+    if_none_match: str | None = Header(default=None),
+    work_dir: Path = Depends(get_work_dir),
+):
+    """
+    返回单个点云节点（二进制格式），见 PointCloudLod.encode_node
+    """
+    if not (work_dir / "fused.ply").exists():
+        raise HTTPException(status_code=404, detail="PLY文件未找到")
+    try:
+        lod = await run_in_threadpool(load_pointcloud_lod, work_dir)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"构建点云LOD时出错: {str(e)}")
+    etag = f'"{lod.source}-{node_id}-{compression}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    try:
+        payload = await run_in_threadpool(lod.encode_node, node_id, compression)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if compression != "none":
+        headers["Content-Encoding"] = compression
+    return Response(
+        content=payload, media_type="application/octet-stream", headers=headers
+    )
+
+
+def encode_dem(
+    dem_service: DemService, dtype: ElevationDtype, compression: Compression
+):
+    """在线程池中编码并压缩DEM，避免阻塞事件循环"""
+    profile, elevation, rgb = dem_service.export_dem()
+    payload = encode_dem_binary(
+        profile, elevation, rgb, dtype, nodata_mask=dem_service.nodata_mask
+    )
+    return compress(payload, compression)
+
+
 @router.get("/dem")
-async def get_dem(dem_service: DemService = Depends(get_dem_service)):
+async def get_dem(
+    format: Literal["json", "binary"] = "json",
+    dtype: ElevationDtype = "float32",
+    compression: Compression = "none",
+    if_none_match: str | None = Header(default=None),
+    dem_service: DemService = Depends(get_dem_service),
+):
     """
     返回DEM数据，包括高程信息和RGB纹理
     4波段：第1波段为高程，第2-4波段为RGB
+    format=binary 时返回二进制格式，见 encode_dem_binary
+    JSON 格式的行保持由南向北的顺序，与前端 DEM 查看器一致；二进制格式与瓦片为北向上
     """
+    if format == "binary":
+        etag = f'"{dem_service.version}-{dtype}-{compression}"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        try:
+            payload = await run_in_threadpool(
+                encode_dem, dem_service, dtype, compression
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"处理DEM文件时出错: {str(e)}")
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if compression != "none":
+            headers["Content-Encoding"] = compression
+        return Response(
+            content=payload, media_type="application/octet-stream", headers=headers
+        )
+
     try:
         profile, elevation, rgb = dem_service.export_dem()
+        elevation = elevation[::-1]
+        if rgb is not None:
+            rgb = rgb[:, ::-1]
         # 准备返回的数据
         response_data = {
             # === 核心数据 ===
@@ -157,12 +331,10 @@ async def get_dem(dem_service: DemService = Depends(get_dem_service)):
         elevation_data = np.nan_to_num(elevation_data, nan=0.0)
 
         response_data["elevation"] = elevation_data.tolist()
-        # RGB纹理数据 (第2-4波段，索引1-3)
-        rgb_data = rgb.astype(np.uint8)  # Shape: (3, height, width)
-
-        # 转换为 (height, width, 3) 格式
-        rgb_normalized = np.transpose(rgb_data, (1, 2, 0))
-        response_data["texture"] = rgb_normalized.tolist()
+        # RGB纹理数据 (第2-4波段，索引1-3)，Shape: (3, height, width)
+        if rgb is not None:
+            # 转换为 (height, width, 3) 格式
+            response_data["texture"] = np.transpose(rgb, (1, 2, 0)).tolist()
 
         return response_data
 
@@ -170,23 +342,118 @@ async def get_dem(dem_service: DemService = Depends(get_dem_service)):
         raise HTTPException(status_code=500, detail=f"处理DEM文件时出错: {str(e)}")
 
 
-class DemSaveRequest(BaseModel):
-    format: str
-    height_scale: float
+class TileIndex(BaseModel):
+    """金字塔瓦片的级别 z 与列、行号 x、y"""
+
+    z: int
+    x: int
+    y: int
+
+
+def encode_tile(
+    dem_service: DemService,
+    tile: TileIndex,
+    *,
+    dtype: ElevationDtype,
+    compression: Compression,
+):
+    """编码单张金字塔瓦片，格式与 format=binary 的 /dem 相同"""
+    z, x, y = tile.z, tile.x, tile.y
+    profile, _, _ = dem_service.export_dem()
+    elevation, rgb = dem_service.pyramid.tile(z, x, y)  # type: ignore[union-attr]
+    height, width = elevation.shape
+    tile_profile = {
+        **profile,
+        "width": width,
+        "height": height,
+        "transform": dem_service.pyramid.tile_transform(  # type: ignore[union-attr]
+            profile["transform"], z, x, y
+        ),
+    }
+    return compress(encode_dem_binary(tile_profile, elevation, rgb, dtype), compression)
+
+
+@router.get("/dem/preprocess")
+async def get_dem_preprocess(dem_service: DemService = Depends(get_dem_service)):
+    """
+    返回最近一次生成DEM时点云预处理各步骤的输入点数与剔除的点数
+    """
+    return {"steps": dem_service.preprocess_stats}
+
+
+@router.get("/dem/tiles")
+async def get_dem_tiles(dem_service: DemService = Depends(get_dem_service)):
+    """
+    返回DEM瓦片金字塔的元信息
+    """
+    pyramid = dem_service.pyramid
+    if pyramid is None:
+        raise HTTPException(status_code=404, detail="DEM瓦片尚未生成")
+    return {
+        "tile_size": pyramid.tile_size,
+        "max_zoom": pyramid.max_zoom,
+        "levels": [
+            {
+                "width": pyramid.level_shape(z)[1],
+                "height": pyramid.level_shape(z)[0],
+                "tiles_x": pyramid.tile_count(z)[0],
+                "tiles_y": pyramid.tile_count(z)[1],
+            }
+            for z in range(pyramid.max_zoom + 1)
+        ],
+    }
+
+
+@router.get("/dem/tiles/{z}/{x}/{y}")
+async def get_dem_tile(
+    tile: Annotated[TileIndex, Depends()],
+    dtype: ElevationDtype = "float32",
+    compression: Compression = "none",
+    if_none_match: str | None = Header(default=None),
+    dem_service: DemService = Depends(get_dem_service),
+):
+    """
+    返回DEM金字塔中的单张瓦片（二进制格式）
+    z=0 为覆盖全图的最粗级别，z=max_zoom 为原始分辨率
+    """
+    if dem_service.pyramid is None:
+        raise HTTPException(status_code=404, detail="DEM瓦片尚未生成")
+    etag = f'"{dem_service.version}-{tile.z}-{tile.x}-{tile.y}-{dtype}-{compression}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    try:
+        payload = await run_in_threadpool(
+            encode_tile, dem_service, tile, dtype=dtype, compression=compression
+        )
+    except IndexError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"处理DEM瓦片时出错: {str(e)}")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if compression != "none":
+        headers["Content-Encoding"] = compression
+    return Response(
+        content=payload, media_type="application/octet-stream", headers=headers
+    )
+
+
+class DemSaveRequest(ExportOptions):
     file_path: str
 
 
-@router.get("/dem/save")
+@router.post("/dem/save")
 async def save_dem(
     request_data: DemSaveRequest,
     dem_service: DemService = Depends(get_dem_service),
 ):
     """
-    保存生成的DEM数据为GeoTIFF格式
+    按 format 导出生成的DEM：GeoTIFF、COG、16 位 PNG 高程图或三角网（PLY/OBJ/glTF）
     """
     try:
-        # 保存DEM文件到临时目录
-        dem_service.save_dem(request_data.file_path)
+        # 逐块编码与写入较慢，在线程池中执行
+        await run_in_threadpool(
+            dem_service.save_dem, request_data.file_path, options=request_data
+        )
 
         return {"message": "DEM saved successfully."}
     except Exception as e:
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect
 
 from ..dependencies import get_stream_service
 from ..services import StreamService
@@ -8,15 +10,33 @@ router = APIRouter(prefix="/ws", tags=["websockets"])
 
 @router.websocket("/video")
 async def video_stream(
-    websocket: WebSocket, stream_service: StreamService = Depends(get_stream_service)
+    websocket: WebSocket,
+    quality: int | None = Query(None, ge=1, le=100),
+    codec: Literal["jpeg", "h264"] = "jpeg",
+    stream_service: StreamService = Depends(get_stream_service),
 ):
+    """
+    视频流，quality 为本客户端的 JPEG 质量上限
+    自适应模式下服务端会在上限内根据网络状况调整画质、分辨率与帧率
+    codec=h264 时（仅直通模式）直接转发无人机的 H.264 访问单元
+    """
+    if codec == "h264" and not stream_service.passthrough:
+        await websocket.close(code=1003, reason="H.264 passthrough is disabled")
+        return
+    client = await stream_service.connect_client(websocket, quality, codec)
     try:
-        await stream_service.connect_client(websocket)
-        if stream_service.stream_task:
-            await stream_service.stream_task
+        await client.task  # type: ignore[misc]
     except WebSocketDisconnect:
         pass
     except Exception as e:
         raise Exception(f"WebSocket error: {str(e)}")
     finally:
-        await stream_service.disconnect_client()
+        await stream_service.disconnect_client(client)
+
+
+@router.get("/video/stats")
+async def video_stream_stats(
+    stream_service: StreamService = Depends(get_stream_service),
+):
+    """返回每个视频订阅者的帧率与丢帧统计"""
+    return stream_service.stats()
@@ -1,15 +1,65 @@
-from .dem import DemConfig, DemService
+from .dem import (
+    Compression,
+    DemConfig,
+    DemService,
+    ElevationDtype,
+    ExportFormat,
+    ExportOptions,
+    compress,
+    encode_dem_binary,
+)
 from .drone_service import DroneCommand, DroneService
-from .ply import PlyService
-from .record_service import RecordService
-from .stream_service import StreamService
+from .h264_relay import H264Relay
+from .image_service import ImageEntry, ImageService, ImageSize
+from .job_service import JobInfo, JobProgress, JobService
+from .keyframe_service import (
+    KeyframeConfig,
+    KeyframeSelector,
+    LiveKeyframeIngest,
+    extract_keyframes,
+    extract_recording_keyframes,
+)
+from .ply import (
+    FeatureConfig,
+    PlyService,
+    PointCloudLod,
+    load_pointcloud_lod,
+    source_stamp,
+)
+from .record_service import RecordService, is_recording_dir, read_recording_index
+from .stream_service import StreamConfig, StreamService
 
 __all__ = [
+    "Compression",
     "DemConfig",
     "DemService",
     "DroneCommand",
     "DroneService",
+    "ElevationDtype",
+    "ExportFormat",
+    "ExportOptions",
+    "FeatureConfig",
+    "H264Relay",
+    "ImageEntry",
+    "ImageService",
+    "ImageSize",
+    "JobInfo",
+    "JobProgress",
+    "JobService",
+    "KeyframeConfig",
+    "KeyframeSelector",
+    "LiveKeyframeIngest",
     "PlyService",
+    "PointCloudLod",
     "RecordService",
+    "StreamConfig",
     "StreamService",
+    "compress",
+    "encode_dem_binary",
+    "extract_keyframes",
+    "extract_recording_keyframes",
+    "is_recording_dir",
+    "load_pointcloud_lod",
+    "read_recording_index",
+    "source_stamp",
 ]
@@ -0,0 +1,138 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from pydantic import BaseModel
+
+# 采样哈希时读取的块数与块大小
+SAMPLE_BLOCKS = 16
+SAMPLE_SIZE = 64 * 1024
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    点云文件的快速指纹：文件大小、修改时间与均匀采样的若干内容块
+    """
+    stat = os.stat(path)
+    digest = hashlib.blake2b(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        step = max(stat.st_size // SAMPLE_BLOCKS, SAMPLE_SIZE)
+        for offset in range(0, stat.st_size, step):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def _link(src: Path, dst: Path):
+    """硬链接 src 到 dst，文件系统不支持时复制"""
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise  # 源文件不存在（未缓存或已被淘汰），不回退到复制
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class DiskCache:
+    """
+    以 (内容指纹, 配置) 为键的数组结果磁盘缓存，DEM 结果与图片特征/匹配共用
+    结果保存为压缩的 .npz，按总字节数做 LRU 淘汰（以文件修改时间记录最近使用）
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, exclude: set[str]):
+        self.cache_dir = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # 不影响插值结果的配置字段
+        self.exclude = exclude
+
+    def key(self, fingerprint: str, config: BaseModel) -> str:
+        config_json = config.model_dump_json(exclude=self.exclude)
+        return hashlib.blake2b(f"{fingerprint}:{config_json}".encode()).hexdigest()
+
+    def _path(self, key: str):
+        return self.cache_dir / f"{key}.npz"
+
+    def get(self, key: str) -> dict[str, np.ndarray] | None:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            path.unlink(missing_ok=True)
+            return None
+        self._touch(path)
+        return arrays
+
+    def link(self, key: str, dest: Path) -> bool:
+        """
+        把缓存项链接到 dest，缓存中没有时返回 False
+        只按文件是否存在判断，不读取内容；dest 不受之后的淘汰影响
+        """
+        path = self._path(key)
+        try:
+            _link(path, dest)
+        except FileNotFoundError:
+            return False
+        self._touch(path)
+        return True
+
+    @staticmethod
+    def _touch(path: Path):
+        """记录最近使用；缓存项可能刚被其他进程淘汰"""
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+
+    def _temp_path(self):
+        """
+        缓存目录共用于多个作业进程，每次写入使用唯一的临时文件，
+        同一缓存项的并发写入不会互相覆盖或替换走对方的临时文件
+        """
+        fd, name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        return Path(name)
+
+    def add(self, key: str, src: Path):
+        """把已写好的 .npz 文件链接进缓存"""
+        tmp_path = self._temp_path()
+        try:
+            _link(src, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self._evict()
+
+    def put(self, key: str, **arrays: np.ndarray | None):
+        tmp_path = self._temp_path()
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(
+                    f, **{name: a for name, a in arrays.items() if a is not None}
+                )
+            os.replace(tmp_path, self._path(key))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # 已被其他进程淘汰
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,14 @@
+import os
+
+# 同时运行的作业数，由 JobService 在作业进程启动时设置，各作业内的进程池平分 CPU
+_job_slots = 1
+
+
+def set_job_slots(job_slots: int):
+    global _job_slots  # noqa: PLW0603
+    _job_slots = max(1, job_slots)
+
+
+def worker_count(workers: int):
+    """实际使用的进程数，不超过每个作业可用的 CPU 数"""
+    return max(1, min(workers, (os.cpu_count() or 1) // _job_slots))
@@ -1,3 +1,16 @@
 from .dem_service import DemConfig, DemService
+from .export import EXPORTERS, ExportFormat, ExportOptions, register_exporter
+from .transport import Compression, ElevationDtype, compress, encode_dem_binary
 
-__all__ = ["DemConfig", "DemService"]
+__all__ = [
+    "EXPORTERS",
+    "Compression",
+    "DemConfig",
+    "DemService",
+    "ElevationDtype",
+    "ExportFormat",
+    "ExportOptions",
+    "compress",
+    "encode_dem_binary",
+    "register_exporter",
+]
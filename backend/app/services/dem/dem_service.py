@@ -1,5 +1,10 @@
+import functools
+import json
 import os
-from typing import Literal, TypedDict
+import tempfile
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import Literal, NamedTuple, TypedDict
 
 import numpy as np
 import open3d as o3d
@@ -7,23 +12,298 @@ import rasterio
 from affine import Affine
 from pydantic import BaseModel
 from rasterio.transform import from_origin
+from rasterio.windows import Window
+from scipy.spatial import cKDTree  # type: ignore[import-not-found]
 
+from ..cache import DiskCache, file_fingerprint
+from ..cpu import worker_count
+from .export import (
+    DENSITY_BAND,
+    DemSource,
+    DemTile,
+    ExportOptions,
+    export_to_file,
+    write_geotiff,
+)
 from .interpolator import (
+    Triangulation,
+    batched_kriging_interpolation,
+    binning_color_interpolation,
+    binning_interpolation,
+    fit_variogram,
     idw_interpolation,
     kriging_interpolation,
+    natural_neighbor_interpolation,
     nearest_color_interpolation,
+    tin_linear_interpolation,
+    triangulate,
+)
+from .preprocess import (
+    ground_mask,
+    remove_radius_outliers,
+    remove_statistical_outliers,
+    voxel_downsample,
+)
+from .pyramid import DemPyramid, Pooling
+from .streaming import (
+    TileBuckets,
+    plan_streaming,
+    read_ply_chunks,
+    read_ply_header,
 )
+from .workers import get_worker_pool
+
+# GeoTIFF 分块与金字塔瓦片共用的边长
+TILE_SIZE = 256
+
+# 分块生成的 GeoTIFF 读入内存作为预览结果时的最大边长（网格数）
+PREVIEW_SIZE = 4096
+
+# 不影响插值结果、不参与缓存键的配置字段
+CACHE_EXCLUDE = {
+    "block_size",
+    "pyramid_pooling",
+    "streaming",
+    "memory_budget_mb",
+    "halo",
+    "workers",
+    "worker_tile_size",
+}
+
+# 影响点云预处理结果的配置字段，预处理后的点云与 KD 树按这些字段复用
+PREPROCESS_FIELDS = {
+    "voxel_size",
+    "outlier_removal",
+    "outlier_neighbors",
+    "outlier_std_ratio",
+    "outlier_radius",
+    "ground_filter",
+    "ground_cell_size",
+    "ground_max_window",
+    "ground_slope",
+    "ground_initial_distance",
+    "ground_max_distance",
+}
+
+# 基于 Delaunay 三角网的插值方法，三角网按点云缓存
+TIN_METHODS = {"tin_linear", "natural_neighbor"}
+
+# 阶段进度回调，参数为阶段名；任务被取消时回调抛出异常以中断生成
+ProgressCallback = Callable[[str], None]
 
 
 class DemConfig(BaseModel):
     colors_data: bool = True
-    method: Literal["idw", "kriging"] = "idw"
+    # 高程与方差的存储类型，无数据网格为 NaN 并记录在 nodata_mask 中
+    dtype: Literal["float32", "float64"] = "float32"
+    method: Literal[
+        "idw", "kriging", "kriging_batched", "binning", "tin_linear", "natural_neighbor"
+    ] = "idw"
     grid_size: int = 500
+    # IDW 参数
+    power: float = 2.0
+    k: int = 10
+    block_size: int = 65536
+    # 批量克里金参数
+    variogram_model: Literal[
+        "linear", "power", "gaussian", "spherical", "exponential"
+    ] = "linear"
+    variogram_samples: int = 5000
+    # 克里金插值的进程数与分发给常驻进程池的瓦片边长（网格数），为 1 时在当前进程计算
+    # 进程数不超过 CPU 数除以同时运行的作业数
+    workers: int = os.cpu_count() or 1
+    worker_tile_size: int = 64
+    # 分箱统计参数：每个网格内点高程的统计量，空网格用 IDW（power、k）补洞或留空
+    bin_statistic: Literal["mean", "min", "max", "median"] = "mean"
+    bin_fill: Literal["none", "idw"] = "idw"
+    # 颜色插值参数，color_k > 1 时按反距离权重混合 k 个近邻的颜色
+    color_k: int = 1
+    # 瓦片金字塔的下采样方式
+    pyramid_pooling: Pooling = "mean"
+    # 分块生成参数：内存预算与瓦片 halo 宽度（像元）
+    # 内存预算尽力而为：瓦片边长不小于 GeoTIFF 分块边长，点密度很高时
+    # 单个瓦片（含 halo）的点数可能超出预算
+    streaming: bool = False
+    memory_budget_mb: int = 1024
+    halo: int = 16
+    # 点云预处理：体素下采样边长（0 为不下采样）
+    voxel_size: float = 0.0
+    # 离群点剔除：统计滤波（近邻平均距离）或半径滤波（半径内邻居数）
+    outlier_removal: Literal["none", "statistical", "radius"] = "none"
+    outlier_neighbors: int = 20
+    outlier_std_ratio: float = 2.0
+    outlier_radius: float = 1.0
+    # 渐进形态学地面滤波：栅格边长、最大窗口（与坐标同单位）、坡度与高差阈值
+    ground_filter: bool = False
+    ground_cell_size: float = 1.0
+    ground_max_window: float = 16.0
+    ground_slope: float = 0.3
+    ground_initial_distance: float = 0.5
+    ground_max_distance: float = 3.0
+
+
+class CloudIndex(NamedTuple):
+    """点云的空间索引，未建立的为 None"""
+
+    tree: cKDTree | None
+    triangulation: Triangulation | None
+
+
+def _binning(points, grid_x, grid_y, config: DemConfig, index: CloudIndex):
+    dem, density = binning_interpolation(
+        points,
+        grid_x,
+        grid_y,
+        statistic=config.bin_statistic,
+        fill=config.bin_fill,
+        power=config.power,
+        k=config.k,
+        block_size=config.block_size,
+    )
+    return dem, None, density
+
+
+def _tin_linear(points, grid_x, grid_y, config: DemConfig, index: CloudIndex):
+    dem = tin_linear_interpolation(
+        points,
+        grid_x,
+        grid_y,
+        triangulation=index.triangulation,
+        block_size=config.block_size,
+    )
+    return dem, None, None
+
+
+def _natural_neighbor(points, grid_x, grid_y, config: DemConfig, index: CloudIndex):
+    dem = natural_neighbor_interpolation(
+        points,
+        grid_x,
+        grid_y,
+        triangulation=index.triangulation,
+        block_size=config.block_size,
+    )
+    return dem, None, None
+
+
+def _idw(points, grid_x, grid_y, config: DemConfig, index: CloudIndex):
+    dem = idw_interpolation(
+        points,
+        grid_x,
+        grid_y,
+        power=config.power,
+        k=config.k,
+        block_size=config.block_size,
+        tree=index.tree,
+    )
+    return dem, None, None
+
+
+def _kriging(points, grid_x, grid_y, config: DemConfig, index: CloudIndex):
+    if worker_count(config.workers) <= 1:
+        dem = kriging_interpolation(points, grid_x, grid_y, tree=index.tree)
+    else:
+        dem = get_worker_pool(config.workers).map_tiles(
+            kriging_interpolation,
+            points,
+            grid_x,
+            grid_y,
+            config.worker_tile_size,
+            n_jobs=1,
+        )
+    return dem, None, None
+
+
+def _kriging_batched(points, grid_x, grid_y, config: DemConfig, index: CloudIndex):
+    if worker_count(config.workers) <= 1:
+        dem, variance = batched_kriging_interpolation(
+            points,
+            grid_x,
+            grid_y,
+            variogram_model=config.variogram_model,
+            sample_size=config.variogram_samples,
+            tree=index.tree,
+        )
+        return dem, variance, None
+    # 变差函数在全体点上拟合一次，各瓦片共用
+    tree = index.tree if index.tree is not None else cKDTree(points[:, :2])
+    gamma = fit_variogram(
+        points,
+        tree,
+        config.variogram_model,
+        sample_size=config.variogram_samples,
+    )
+    if gamma is None:
+        return np.full(grid_x.shape, np.nan), np.full(grid_x.shape, np.nan), None
+    dem, variance = get_worker_pool(config.workers).map_tiles(
+        batched_kriging_interpolation,
+        points,
+        grid_x,
+        grid_y,
+        config.worker_tile_size,
+        n_jobs=1,
+        gamma=gamma,
+    )
+    return dem, variance, None
+
+
+# 插值方法 -> 插值函数，参数为 (points, grid_x, grid_y, config, index)，
+# 返回 (dem, variance, density)，不适用的项为 None
+INTERPOLATORS = {
+    "binning": _binning,
+    "tin_linear": _tin_linear,
+    "natural_neighbor": _natural_neighbor,
+    "idw": _idw,
+    "kriging": _kriging,
+    "kriging_batched": _kriging_batched,
+}
+
+
+class DemGrid(NamedTuple):
+    """
+    规则网格：西北角网格点坐标、分辨率与形状，行方向从北向南
+    坐标轴按需由原点与分辨率生成，不保存二维坐标数组
+    """
+
+    west: float
+    north: float
+    xres: float
+    yres: float
+    height: int
+    width: int
+
+    @classmethod
+    def from_bounds(cls, min_x: float, min_y: float, max_x: float, max_y: float, shape):
+        height, width = shape
+        xres = (max_x - min_x) / (width - 1) if width > 1 else 1.0
+        yres = (max_y - min_y) / (height - 1) if height > 1 else 1.0
+        return cls(float(min_x), float(max_y), float(xres), float(yres), height, width)
+
+    @classmethod
+    def from_array(cls, values: np.ndarray):
+        west, north, xres, yres, height, width = values.tolist()
+        return cls(west, north, xres, yres, int(height), int(width))
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    @property
+    def x(self):
+        return self.west + np.arange(self.width) * self.xres
+
+    @property
+    def y(self):
+        return self.north - np.arange(self.height) * self.yres
+
+    @property
+    def transform(self):
+        return from_origin(self.west, self.north, self.xres, self.yres)
 
 
 class Profile(TypedDict):
     driver: str
     dtype: str
+    nodata: float
     count: int
     height: int
     width: int
@@ -36,12 +316,38 @@ class Profile(TypedDict):
 
 
 class DemService:
-    def __init__(self):
+    def __init__(
+        self, cache_dir: Path | None = None, cache_max_bytes: int = 2 * 1024**3
+    ):
         self.dem: np.ndarray | None = None
-        self.grid_x: np.ndarray
-        self.grid_y: np.ndarray
-        self.color_grid: np.ndarray
+        self.grid: DemGrid | None = None
+        # 无数据网格的掩码，与 dem 同形
+        self.nodata_mask: np.ndarray | None = None
+        # (height, width, 3) uint8
+        self.color_grid: np.ndarray | None = None
+        self.variance: np.ndarray | None = None
+        # 分箱统计时每个网格内的点数
+        self.density: np.ndarray | None = None
+        self.pyramid: DemPyramid | None = None
         self.profile: Profile | None = None
+        # 每次生成 DEM 后递增，用于 ETag
+        self.generation = 0
+        # 由 load_result 读取的结果文件的版本（大小与修改时间），区分不同作业的结果
+        self.result_stamp = ""
+        self.cache = DiskCache(
+            cache_dir or Path(tempfile.gettempdir()) / "dem" / "cache",
+            cache_max_bytes,
+            CACHE_EXCLUDE,
+        )
+        # 最近一次读取并预处理的点云 (键, 点, 颜色, KD 树)，在不同插值配置之间复用
+        # 分箱统计不需要 KD 树，首次用到时才建立
+        self._cloud: (
+            tuple[str, np.ndarray, np.ndarray | None, cKDTree | None] | None
+        ) = None
+        # 最近一次建立的 Delaunay 三角网 (点云键, 三角网)，重新网格化时复用
+        self._triangulation: tuple[str, Triangulation] | None = None
+        # 最近一次生成时各预处理步骤剔除的点数
+        self.preprocess_stats: list[dict] = []
 
     @staticmethod
     def read_pointcloud(pcd_path: str):
@@ -54,68 +360,501 @@ class DemService:
             raise ValueError(f"Unsupported file format: {ext}")
         return xyz, rgb
 
-    def generate_dem(self, pcd_path: str, config: DemConfig):
-        # 读取点云数据
-        if config.colors_data is not None:
-            ground_points, ground_colors = self.read_pointcloud(pcd_path)
+    @staticmethod
+    def preprocess(
+        points: np.ndarray,
+        colors: np.ndarray | None,
+        config: DemConfig,
+        core: Callable[[np.ndarray], np.ndarray] | None = None,
+    ):
+        """
+        按配置依次进行体素下采样、离群点剔除与地面滤波
+        返回 (points, colors, stats)，stats 记录每一步的输入点数与剔除的点数
+        core 为分块生成时瓦片核心区域的掩码函数，只统计核心区域内的点，不重复计入 halo
+        """
+        stats = []
+
+        def count(points: np.ndarray):
+            return len(points) if core is None else int(core(points).sum())
+
+        def record(step: str, before: int):
+            stats.append(
+                {"step": step, "before": before, "removed": before - count(points)}
+            )
+
+        if config.voxel_size > 0:
+            before = count(points)
+            points, colors = voxel_downsample(points, colors, config.voxel_size)
+            record("voxel", before)
+        if config.outlier_removal == "statistical":
+            before = count(points)
+            points, colors = remove_statistical_outliers(
+                points, colors, config.outlier_neighbors, config.outlier_std_ratio
+            )
+            record("statistical_outlier", before)
+        elif config.outlier_removal == "radius":
+            before = count(points)
+            points, colors = remove_radius_outliers(
+                points, colors, config.outlier_neighbors, config.outlier_radius
+            )
+            record("radius_outlier", before)
+        if config.ground_filter and len(points):
+            before = count(points)
+            mask = ground_mask(
+                points,
+                cell_size=config.ground_cell_size,
+                max_window=config.ground_max_window,
+                slope=config.ground_slope,
+                initial_distance=config.ground_initial_distance,
+                max_distance=config.ground_max_distance,
+            )
+            points = points[mask]
+            colors = None if colors is None else colors[mask]
+            record("ground", before)
+        return points, colors, stats
+
+    @staticmethod
+    def _interpolate(
+        points,
+        colors,
+        grid_x,
+        grid_y,
+        config: DemConfig,
+        *,
+        tree=None,
+        triangulation: Triangulation | None = None,
+        progress: ProgressCallback | None = None,
+    ):
+        """按配置插值高程与颜色，返回 (dem, variance, density, color_grid)"""
+        if progress:
+            progress("interpolation")
+        dem, variance, density = INTERPOLATORS[config.method](
+            points, grid_x, grid_y, config, CloudIndex(tree, triangulation)
+        )
+
+        # 颜色插值
+        color_grid = None
+        if colors is not None:
+            if progress:
+                progress("color")
+            if config.method == "binning":
+                color_grid = binning_color_interpolation(
+                    points, colors, grid_x, grid_y, block_size=config.block_size
+                )
+                return dem, variance, density, color_grid
+            color_grid = nearest_color_interpolation(
+                points,
+                colors,
+                grid_x,
+                grid_y,
+                k=config.color_k,
+                power=config.power,
+                block_size=config.block_size,
+                tree=tree,
+            )
+        return dem, variance, density, color_grid
+
+    def _load_cloud(self, pcd_path: str, fingerprint: str, config: DemConfig):
+        """
+        读取并预处理点云、建立 KD 树，同一点云与预处理配置在多次生成之间复用
+        分箱统计不做近邻查询，返回的 KD 树为 None；
+        三角网插值时一并返回缓存的 Delaunay 三角网，否则或三角网退化时为 None
+        """
+        cloud_key = f"{fingerprint}:{config.model_dump_json(include=PREPROCESS_FIELDS)}"
+        if self._cloud is None or self._cloud[0] != cloud_key:
+            self._cloud = None
+            self._triangulation = None
+            points, colors = self.read_pointcloud(pcd_path)
+            points, colors, self.preprocess_stats = self.preprocess(
+                points, colors, config
+            )
+            self._cloud = (cloud_key, points, colors, None)
+        key, points, colors, tree = self._cloud
+        if tree is None and config.method != "binning":
+            tree = cKDTree(points[:, :2])
+            self._cloud = (key, points, colors, tree)
+        triangulation = None
+        if config.method in TIN_METHODS:
+            if self._triangulation is None or self._triangulation[0] != key:
+                self._triangulation = (key, triangulate(points))
+            triangulation = self._triangulation[1]
+        return points, colors, tree, triangulation
+
+    def generate_dem(
+        self,
+        pcd_path: str,
+        config: DemConfig,
+        progress: ProgressCallback | None = None,
+    ):
+        fingerprint = file_fingerprint(pcd_path)
+        key = self.cache.key(fingerprint, config)
+        cached = self.cache.get(key)
+        if cached is not None:
+            grid = DemGrid.from_array(cached["grid"])
+            dem = cached["dem"]
+            variance = cached.get("variance")
+            density = cached.get("density")
+            color_grid = cached.get("color_grid")
+            if "preprocess" in cached:
+                self.preprocess_stats = json.loads(str(cached["preprocess"]))
         else:
-            ground_points, _ = self.read_pointcloud(pcd_path)
-            ground_colors = None
-
-        # 网格大小设置
-        min_x, max_x = ground_points[:, 0].min(), ground_points[:, 0].max()
-        min_y, max_y = ground_points[:, 1].min(), ground_points[:, 1].max()
-        self.grid_x, self.grid_y = np.meshgrid(
-            np.linspace(min_x, max_x, config.grid_size),
-            np.linspace(min_y, max_y, config.grid_size),
+            # 读取并预处理点云数据
+            ground_points, ground_colors, tree, triangulation = self._load_cloud(
+                pcd_path, fingerprint, config
+            )
+            if not config.colors_data:
+                ground_colors = None
+
+            # 网格大小设置，行方向从北向南
+            min_x, min_y = ground_points[:, :2].min(axis=0)
+            max_x, max_y = ground_points[:, :2].max(axis=0)
+            grid = DemGrid.from_bounds(
+                min_x, min_y, max_x, max_y, (config.grid_size, config.grid_size)
+            )
+            # 二维坐标只在插值期间存在
+            grid_x, grid_y = np.meshgrid(grid.x, grid.y)
+            dem, variance, density, color_grid = self._interpolate(
+                ground_points,
+                ground_colors,
+                grid_x,
+                grid_y,
+                config,
+                tree=tree,
+                triangulation=triangulation,
+                progress=progress,
+            )
+            del grid_x, grid_y
+            dem = dem.astype(config.dtype, copy=False)
+            if variance is not None:
+                variance = variance.astype(config.dtype, copy=False)
+            self.cache.put(
+                key,
+                grid=np.array(grid, dtype=np.float64),
+                dem=dem,
+                variance=variance,
+                density=density,
+                color_grid=color_grid,
+                preprocess=np.array(json.dumps(self.preprocess_stats)),
+            )
+
+        if progress:
+            progress("export")
+        self._set_result(
+            grid,
+            dem,
+            variance=variance,
+            density=density,
+            color_grid=color_grid,
+            pyramid_pooling=config.pyramid_pooling,
         )
 
-        if config.method == "idw":
-            self.dem = idw_interpolation(ground_points, self.grid_x, self.grid_y)
-        elif config.method == "kriging":
-            self.dem = kriging_interpolation(ground_points, self.grid_x, self.grid_y)
+    def _set_result(
+        self,
+        grid: DemGrid,
+        dem: np.ndarray,
+        *,
+        variance: np.ndarray | None = None,
+        density: np.ndarray | None = None,
+        color_grid: np.ndarray | None = None,
+        pyramid_pooling: Pooling = "mean",
+    ):
+        self.grid = grid
+        self.dem, self.variance, self.density = dem, variance, density
+        self.nodata_mask = ~np.isfinite(dem)
+        self.color_grid = color_grid
 
-        # 颜色插值
-        if ground_colors is not None:
-            self.color_grid = nearest_color_interpolation(
-                ground_points, ground_colors, self.grid_x, self.grid_y
+        self.pyramid = DemPyramid(
+            self.dem,
+            color_grid,
+            tile_size=TILE_SIZE,
+            pooling=pyramid_pooling,
+        )
+        self.profile = None
+        self.generation += 1
+
+    def save_result(self, path: Path):
+        """保存当前 DEM 结果，供其他进程通过 load_result 读取"""
+        if self.dem is None or self.grid is None:
+            raise ValueError("DEM data has not been generated yet.")
+        arrays = {
+            "grid": np.array(self.grid, dtype=np.float64),
+            "dem": self.dem,
+            "variance": self.variance,
+            "density": self.density,
+            "color_grid": self.color_grid,
+            "preprocess": np.array(json.dumps(self.preprocess_stats)),
+        }
+        with open(path, "wb") as f:
+            np.savez(f, **{name: a for name, a in arrays.items() if a is not None})
+
+    @property
+    def version(self):
+        """结果版本，用于 ETag"""
+        return f"{self.result_stamp}-{self.generation}"
+
+    def load_result(self, path: Path):
+        stat = path.stat()
+        self.result_stamp = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+        with np.load(path) as data:
+            if "preprocess" in data:
+                self.preprocess_stats = json.loads(str(data["preprocess"]))
+            self._set_result(
+                DemGrid.from_array(data["grid"]),
+                data["dem"],
+                variance=data.get("variance"),
+                density=data.get("density"),
+                color_grid=data.get("color_grid"),
             )
 
-    def save_dem(self, output_path: str):
-        # 保存 DEM 为 GeoTIFF 格式
-        profile, elevation, rgb = self.export_dem()
-        with rasterio.open(output_path, "w", **profile) as dst:
-            dst.write(elevation, 1)
-            if rgb is not None:
-                dst.write(rgb[0], 2)
-                dst.write(rgb[1], 3)
-                dst.write(rgb[2], 4)
+    def load_geotiff(self, path: Path, max_size: int = PREVIEW_SIZE):
+        """
+        读取分块生成的 GeoTIFF 作为当前结果，边长超过 max_size 时按等间隔抽稀网格点
+        按 TILE_SIZE 行的条带逐块读取，不读入整幅 GeoTIFF
+        """
+        with rasterio.open(path) as src:
+            step = max(1, -(-max(src.height, src.width) // max_size))
+            rows = np.arange(0, src.height, step)
+            cols = np.arange(0, src.width, step)
+            bands = np.empty((src.count, len(rows), len(cols)), dtype=src.dtypes[0])
+            for start in range(0, src.height, TILE_SIZE):
+                height = min(TILE_SIZE, src.height - start)
+                picked = (rows >= start) & (rows < start + height)
+                if not picked.any():
+                    continue
+                strip = src.read(window=Window(0, start, src.width, height))
+                bands[:, picked] = strip[:, rows[picked] - start][:, :, cols]
+            transform = src.transform
+
+        dem = bands[0]
+        # 未写入颜色时 RGB 波段全为 0 或无数据
+        rgb = np.nan_to_num(bands[1:4])
+        color_grid = (
+            np.moveaxis(rgb.astype(np.uint8), 0, -1).copy() if rgb.any() else None
+        )
+        density = (
+            bands[DENSITY_BAND - 1].astype(np.int32)
+            if len(bands) >= DENSITY_BAND
+            else None
+        )
+        grid = DemGrid(
+            transform.c,
+            transform.f,
+            transform.a * step,
+            -transform.e * step,
+            len(rows),
+            len(cols),
+        )
+        self._set_result(grid, dem, density=density, color_grid=color_grid)
+
+    def generate_dem_streaming(
+        self,
+        pcd_path: str,
+        config: DemConfig,
+        output_path: str,
+        progress: ProgressCallback | None = None,
+    ):
+        """
+        分块生成 DEM 并直接写入 GeoTIFF，峰值内存尽量不超过 config.memory_budget_mb
+        1. 内存映射分块读取 PLY，统计范围
+        2. 按输出瓦片（含 halo）把点分桶写入临时文件
+        3. 逐瓦片插值并按窗口写入 GeoTIFF
+        """
+        memory_budget = config.memory_budget_mb * 1024 * 1024
+        count, _, _ = read_ply_header(pcd_path)
+        chunk_size, tile_size = plan_streaming(
+            count, config.grid_size**2, memory_budget, TILE_SIZE
+        )
+        tile_size = min(tile_size, -(-config.grid_size // TILE_SIZE) * TILE_SIZE)
+
+        min_xy = np.full(2, np.inf)
+        max_xy = np.full(2, -np.inf)
+        for xyz, _ in read_ply_chunks(pcd_path, chunk_size):
+            min_xy = np.minimum(min_xy, xyz[:, :2].min(axis=0))
+            max_xy = np.maximum(max_xy, xyz[:, :2].max(axis=0))
+        (min_x, min_y), (max_x, max_y) = min_xy, max_xy
+        grid = DemGrid.from_bounds(
+            min_x, min_y, max_x, max_y, (config.grid_size, config.grid_size)
+        )
+        buckets = TileBuckets(
+            (min_x, min_y, max_x, max_y),
+            (grid.xres, grid.yres),
+            (config.grid_size, config.grid_size),
+            tile_size,
+            config.halo,
+        )
+        try:
+            for xyz, rgb in read_ply_chunks(pcd_path, chunk_size):
+                buckets.add(xyz, rgb if config.colors_data else None)
+
+            binning = config.method == "binning"
+            self.dem = None
+            self.grid = None
+            self.nodata_mask = None
+            self.color_grid = None
+            self.variance = None
+            self.density = None
+            self.pyramid = None
+            self.preprocess_stats = []
+            self.profile = self._make_profile(
+                config.grid_size,
+                config.grid_size,
+                grid.transform,
+                config.dtype,
+                count=DENSITY_BAND if binning else DENSITY_BAND - 1,
+            )
+            self.save_dem(
+                output_path, self._stream_tiles(buckets, grid, config, progress)
+            )
+        finally:
+            buckets.cleanup()
+        self.generation += 1
+
+    def _stream_tiles(
+        self,
+        buckets: TileBuckets,
+        grid: DemGrid,
+        config: DemConfig,
+        progress: ProgressCallback | None,
+    ):
+        """逐瓦片预处理与插值，按窗口依次返回 (window, elevation, rgb, density)"""
+        tile_size = buckets.tile_size
+        binning = config.method == "binning"
+        x, y = grid.x, grid.y
+        for tile_y in range(buckets.tiles_y):
+            for tile_x in range(buckets.tiles_x):
+                rows = np.arange(
+                    tile_y * tile_size,
+                    min((tile_y + 1) * tile_size, config.grid_size),
+                )
+                cols = np.arange(
+                    tile_x * tile_size,
+                    min((tile_x + 1) * tile_size, config.grid_size),
+                )
+                window = Window(cols[0], rows[0], len(cols), len(rows))
+                points, colors = buckets.load(tile_x, tile_y)
+                if points is not None:
+                    # 逐瓦片（含 halo）预处理，累计各步骤剔除的点数
+                    points, colors, stats = self.preprocess(
+                        points,
+                        colors,
+                        config,
+                        functools.partial(
+                            buckets.in_core, tile_x=tile_x, tile_y=tile_y
+                        ),
+                    )
+                    self._merge_preprocess_stats(stats)
+                if points is None or len(points) == 0:
+                    shape = (len(rows), len(cols))
+                    density = np.zeros(shape) if binning else None
+                    yield window, np.full(shape, np.nan), None, density
+                    continue
+                # 分箱统计以相邻网格补洞：在扩展到 halo 的网格上统计与补洞后裁回瓦片，
+                # 瓦片边缘的空网格与整幅生成时一样使用瓦片外的网格；
+                # halo 最外一圈网格的分箱范围超出 halo、点不完整，不参与扩展
+                pad = max(config.halo - 1, 0) if binning else 0
+                ext_rows = np.arange(
+                    max(rows[0] - pad, 0),
+                    min(rows[-1] + pad + 1, config.grid_size),
+                )
+                ext_cols = np.arange(
+                    max(cols[0] - pad, 0),
+                    min(cols[-1] + pad + 1, config.grid_size),
+                )
+                core = np.ix_(rows - ext_rows[0], cols - ext_cols[0])
+                grid_x, grid_y = np.meshgrid(x[ext_cols], y[ext_rows])
+                dem, _, density, color_grid = self._interpolate(
+                    points, colors, grid_x, grid_y, config, progress=progress
+                )
+                dem = dem[core]
+                if density is not None:
+                    density = density[core]
+                if color_grid is not None:
+                    color_grid = np.moveaxis(color_grid[core], -1, 0)
+                yield window, dem.astype(config.dtype), color_grid, density
+
+    def _merge_preprocess_stats(self, stats: list[dict]):
+        for step in stats:
+            merged = next(
+                (s for s in self.preprocess_stats if s["step"] == step["step"]), None
+            )
+            if merged is None:
+                self.preprocess_stats.append(dict(step))
+            else:
+                merged["before"] += step["before"]
+                merged["removed"] += step["removed"]
+
+    def save_dem(
+        self,
+        output_path: str,
+        tiles: Iterable[DemTile] | None = None,
+        options: ExportOptions | None = None,
+    ):
+        """
+        按 options.format 导出当前 DEM，默认为 GeoTIFF，导出格式见 export.EXPORTERS
+        tiles 不为空时按窗口逐块写入 GeoTIFF (window, elevation, rgb, density)，
+        使用当前 profile
+        """
+        options = options or ExportOptions()
+        if tiles is not None:
+            if self.profile is None:
+                raise ValueError("DEM profile has not been generated yet.")
+            write_geotiff(output_path, self.profile, tiles, options)
+            return
+        profile, _, _ = self.export_dem()
+        export_to_file(DemSource(profile, self._blocks), output_path, options)
+
+    def _blocks(self):
+        """按 TILE_SIZE 行的条带逐块返回内存中的 DEM，均为视图，不复制整幅数据"""
+        _, elevation, rgb = self.export_dem()
+        height, width = elevation.shape
+        for start in range(0, height, TILE_SIZE):
+            rows = slice(start, start + TILE_SIZE)
+            yield (
+                Window(0, start, width, min(TILE_SIZE, height - start)),
+                elevation[rows],
+                None if rgb is None else rgb[:, rows],
+                None if self.density is None else self.density[rows],
+            )
+
+    @staticmethod
+    def _make_profile(
+        height: int,
+        width: int,
+        transform: Affine,
+        dtype: str,
+        count: int = DENSITY_BAND - 1,
+    ):
+        return Profile(
+            driver="GTiff",
+            dtype=dtype,
+            count=count,
+            height=height,
+            width=width,
+            nodata=float("nan"),
+            crs="EPSG:4326",
+            transform=transform,
+            compress="deflate",
+            tiled=True,
+            blockxsize=TILE_SIZE,
+            blockysize=TILE_SIZE,
+        )
 
     def export_dem(self):
-        if self.dem is None:
+        """
+        返回 (profile, elevation, rgb)，rgb 为 (3, height, width) 的零拷贝视图
+        不修改已保存的结果，重复调用返回相同的数据
+        """
+        if self.dem is None or self.grid is None:
             raise ValueError("DEM data has not been generated yet.")
         if self.profile is None:
-            height, width = self.dem.shape
-            xres = (self.grid_x.max() - self.grid_x.min()) / (width - 1)
-            yres = (self.grid_y.max() - self.grid_y.min()) / (height - 1)
-            lon0 = self.grid_x.min()
-            lat0 = self.grid_y.max()
-            transform = from_origin(lon0, lat0, xres, yres)
-            crs = "EPSG:4326"
-            # 如果rgb是(高, 宽, 3)，转为(3, 高, 宽)
-            if self.color_grid.shape[-1] == 3:  # noqa: PLR2004
-                self.color_grid = np.transpose(self.color_grid, (2, 0, 1))
-            self.profile = Profile(
-                driver="GTiff",
-                dtype=self.dem.dtype.name,
-                count=4,
-                height=height,
-                width=width,
-                crs=crs,
-                transform=transform,
-                compress="lzw",
-                tiled=True,
-                blockxsize=256,
-                blockysize=256,
-            )
-        return self.profile, self.dem, self.color_grid
+            self.profile = self._make_profile(
+                self.grid.height,
+                self.grid.width,
+                self.grid.transform,
+                self.dem.dtype.name,
+                count=DENSITY_BAND - 1 if self.density is None else DENSITY_BAND,
+            )
+        rgb = None
+        if self.color_grid is not None:
+            rgb = np.moveaxis(self.color_grid, -1, 0)
+        return self.profile, self.dem, rgb
@@ -0,0 +1,243 @@
+import math
+import os
+import tempfile
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import Literal, NamedTuple
+
+import numpy as np
+import open3d as o3d
+import rasterio
+import rasterio.shutil
+from pydantic import BaseModel
+from rasterio.windows import Window
+
+ExportFormat = Literal["geotiff", "cog", "png", "ply", "obj", "gltf"]
+
+# 按窗口写入的一块 (window, elevation, rgb, density)，window 为 None 时为整幅
+DemTile = tuple[Window | None, np.ndarray, np.ndarray | None, np.ndarray | None]
+
+# GeoTIFF 波段：1 为高程，2~4 为 RGB，分箱统计时第 5 波段为点密度
+DENSITY_BAND = 5
+
+
+class ExportOptions(BaseModel):
+    format: ExportFormat = "geotiff"
+    # 高程夸张系数，作用于 PNG 高程图的 scale/offset 与三角网的 z 坐标，
+    # GeoTIFF 保持原始高程
+    height_scale: float = 1.0
+    # GeoTIFF / COG 的压缩方式，浮点高程使用浮点预测器
+    compression: Literal["deflate", "zstd", "lzw"] = "deflate"
+    # GDAL 并行压缩瓦片的线程数（NUM_THREADS）
+    threads: int = os.cpu_count() or 1
+    # 三角网的最大顶点数，超出时按等间隔抽稀网格
+    mesh_max_vertices: int = 1_000_000
+
+
+class DemSource(NamedTuple):
+    """导出的数据源：GeoTIFF profile 与逐块读取 DEM 的函数，每次调用重新遍历"""
+
+    profile: dict
+    blocks: Callable[[], Iterable[DemTile]]
+
+
+Exporter = Callable[[DemSource, Path, ExportOptions], None]
+
+# 导出格式 -> 导出函数
+EXPORTERS: dict[str, Exporter] = {}
+
+
+def register_exporter(*formats: str):
+    """注册导出格式，导出函数的参数为 (source, output_path, options)"""
+
+    def decorator(func: Exporter):
+        for name in formats:
+            EXPORTERS[name] = func
+        return func
+
+    return decorator
+
+
+def export_to_file(source: DemSource, output_path: str, options: ExportOptions):
+    exporter = EXPORTERS.get(options.format)
+    if exporter is None:
+        raise ValueError(f"Unsupported export format: {options.format}")
+    exporter(source, Path(output_path), options)
+
+
+def write_geotiff(
+    output_path: str | Path,
+    profile: dict,
+    tiles: Iterable[DemTile],
+    options: ExportOptions | None = None,
+):
+    """按窗口逐块写入分块 GeoTIFF，分箱统计时第5波段为点密度"""
+    options = options or ExportOptions()
+    floating = np.issubdtype(np.dtype(profile["dtype"]), np.floating)
+    profile = {
+        **profile,
+        "compress": options.compression,
+        "predictor": 3 if floating else 2,
+        "num_threads": options.threads,
+    }
+    with rasterio.open(output_path, "w", **profile) as dst:
+        for window, elevation, rgb, density in tiles:
+            dst.write(elevation, 1, window=window)
+            if rgb is not None:
+                dst.write(rgb[0], 2, window=window)
+                dst.write(rgb[1], 3, window=window)
+                dst.write(rgb[2], 4, window=window)
+            if density is not None:
+                dst.write(density, DENSITY_BAND, window=window)
+
+
+@register_exporter("geotiff")
+def _export_geotiff(source: DemSource, output_path: Path, options: ExportOptions):
+    write_geotiff(output_path, source.profile, source.blocks(), options)
+
+
+@register_exporter("cog")
+def _export_cog(source: DemSource, output_path: Path, options: ExportOptions):
+    """
+    带内部金字塔的 Cloud-Optimized GeoTIFF，GIS 工具可按窗口与层级读取
+    COG 驱动只支持整幅复制，先逐块写入临时的分块 GeoTIFF，再由 GDAL 按块转换
+    """
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as tmp_dir:
+        staging = Path(tmp_dir) / "staging.tif"
+        write_geotiff(staging, source.profile, source.blocks(), options)
+        rasterio.shutil.copy(
+            staging,
+            output_path,
+            driver="COG",
+            compress=options.compression,
+            predictor="YES",
+            blocksize=source.profile["blockxsize"],
+            overview_resampling="AVERAGE",
+            num_threads=options.threads,
+        )
+
+
+def _elevation_range(source: DemSource):
+    low, high = np.inf, -np.inf
+    for _, elevation, _, _ in source.blocks():
+        if np.isfinite(elevation).any():
+            low = min(low, float(np.nanmin(elevation)))
+            high = max(high, float(np.nanmax(elevation)))
+    return (low, high) if low <= high else (0.0, 0.0)
+
+
+@register_exporter("png")
+def _export_png(source: DemSource, output_path: Path, options: ExportOptions):
+    """
+    16 位 PNG 高程图，与 uint16 传输格式相同：0 表示无数据，有效值映射到 1~65535
+    乘以 height_scale 后的高程 = offset + value * scale，
+    scale 与 offset 写入 PNG 文本块，地理参考写入 world 文件
+    """
+    low, high = _elevation_range(source)
+    scale = (high - low) / 65534 if high > low else 1.0
+
+    def tiles():
+        for window, elevation, _, _ in source.blocks():
+            quantized = np.round((elevation - low) / scale) + 1
+            quantized[~np.isfinite(elevation)] = 0
+            yield window, quantized.astype(np.uint16), None, None
+
+    profile = {**source.profile, "dtype": "uint16", "count": 1, "nodata": 0}
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as tmp_dir:
+        staging = Path(tmp_dir) / "staging.tif"
+        write_geotiff(staging, profile, tiles(), options)
+        with rasterio.open(staging, "r+") as dst:
+            dst.update_tags(
+                height_scale=options.height_scale,
+                scale=scale * options.height_scale,
+                offset=(low - scale) * options.height_scale,
+            )
+        rasterio.shutil.copy(
+            staging,
+            output_path,
+            driver="PNG",
+            worldfile="YES",
+            write_metadata_as_text="YES",
+        )
+
+
+def _sample_grid(source: DemSource, step: int):
+    """从逐块读取的 DEM 中按 step 等间隔取样，保留最后一行与一列以覆盖完整范围"""
+    height, width = source.profile["height"], source.profile["width"]
+    rows = np.unique(np.append(np.arange(0, height, step), height - 1))
+    cols = np.unique(np.append(np.arange(0, width, step), width - 1))
+    elevation = np.full((len(rows), len(cols)), np.nan)
+    rgb = None
+    for window, block, block_rgb, _ in source.blocks():
+        row_off = 0 if window is None else int(window.row_off)
+        col_off = 0 if window is None else int(window.col_off)
+        in_rows = (rows >= row_off) & (rows < row_off + block.shape[0])
+        in_cols = (cols >= col_off) & (cols < col_off + block.shape[1])
+        if not in_rows.any() or not in_cols.any():
+            continue
+        target = np.ix_(in_rows, in_cols)
+        picked = np.ix_(rows[in_rows] - row_off, cols[in_cols] - col_off)
+        elevation[target] = block[picked]
+        if block_rgb is not None:
+            if rgb is None:
+                rgb = np.zeros((len(rows), len(cols), 3), dtype=np.uint8)
+            rgb[target] = np.moveaxis(block_rgb[(slice(None), *picked)], 0, -1)
+    return rows, cols, elevation, rgb
+
+
+@register_exporter("ply", "obj", "gltf")
+def _export_mesh(source: DemSource, output_path: Path, options: ExportOptions):
+    """
+    网格按等间隔抽稀到不超过 mesh_max_vertices 个顶点后生成三角网，
+    四角都有数据的网格生成两个三角形，z 坐标乘以 height_scale
+    """
+    profile = source.profile
+    step = max(
+        1,
+        math.ceil(
+            math.sqrt(profile["height"] * profile["width"] / options.mesh_max_vertices)
+        ),
+    )
+    rows, cols, elevation, rgb = _sample_grid(source, step)
+    transform = profile["transform"]
+    x = transform.c + cols * transform.a
+    y = transform.f + rows * transform.e
+    grid_x, grid_y = np.meshgrid(x, y)
+    valid = np.isfinite(elevation)
+    vertices = np.column_stack(
+        (
+            grid_x.ravel(),
+            grid_y.ravel(),
+            np.where(valid, elevation, 0).ravel() * options.height_scale,
+        )
+    )
+
+    # 行方向从北向南：a 西北、b 东北、c 西南、d 东南，从上方看为逆时针
+    index = np.arange(elevation.size).reshape(elevation.shape)
+    quads = valid[:-1, :-1] & valid[:-1, 1:] & valid[1:, :-1] & valid[1:, 1:]
+    a, b = index[:-1, :-1][quads], index[:-1, 1:][quads]
+    c, d = index[1:, :-1][quads], index[1:, 1:][quads]
+    triangles = np.concatenate((np.column_stack((a, c, b)), np.column_stack((b, c, d))))
+
+    mesh = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(vertices),
+        o3d.utility.Vector3iVector(triangles.astype(np.int32)),
+    )
+    if rgb is not None:
+        mesh.vertex_colors = o3d.utility.Vector3dVector(rgb.reshape(-1, 3) / 255.0)
+    mesh.remove_unreferenced_vertices()
+    mesh.compute_vertex_normals()
+
+    # open3d 按扩展名选择格式，先写入带对应扩展名的临时文件
+    fd, tmp_name = tempfile.mkstemp(
+        prefix=f".{output_path.name}.",
+        suffix=f".{options.format}",
+        dir=output_path.parent,
+    )
+    os.close(fd)
+    try:
+        if not o3d.io.write_triangle_mesh(tmp_name, mesh):
+            raise ValueError(f"Failed to write mesh: {output_path}")
+        os.replace(tmp_name, output_path)
+    finally:
+        Path(tmp_name).unlink(missing_ok=True)
@@ -1,10 +1,22 @@
 import os
-from multiprocessing import Pool
+from functools import cached_property, partial
 
 import numpy as np
 from joblib import Parallel, delayed
 from pykrige import OrdinaryKriging
-from scipy.spatial import cKDTree  # type: ignore[import-not-found]
+from pykrige.core import _calculate_variogram_model
+from scipy.spatial import (  # type: ignore[import-not-found]
+    Delaunay,
+    QhullError,
+    cKDTree,
+)
+
+# 拟合变差函数至少需要的点数
+MIN_VARIOGRAM_POINTS = 2
+# 构建三角网至少需要的点数
+MIN_TRIANGLE_POINTS = 3
+# 浮点颜色的最大值超过该值时视为 0~255 的取值范围
+UNIT_COLOR_MAX = 1.1
 
 
 # 克里金插值
@@ -35,11 +47,12 @@ def _krige_single_row(i, grid_x_row, grid_y_row, tree, points, k_neighbors):
 
 # _local_parallel
 def kriging_interpolation(
-    points, grid_x, grid_y, k_neighbors=50, n_jobs=os.cpu_count()
+    points, grid_x, grid_y, *, k_neighbors=50, n_jobs=os.cpu_count(), tree=None
 ):
     # print("Parallel Local Kriging interpolation...")
     dem = np.full(grid_x.shape, np.nan)
-    tree = cKDTree(points[:, :2])
+    if tree is None:
+        tree = cKDTree(points[:, :2])
     rows = grid_x.shape[0]
 
     results = Parallel(n_jobs=n_jobs, prefer="threads")(
@@ -51,85 +64,539 @@ def kriging_interpolation(
     return dem
 
 
+# 批量局部克里金插值
+def fit_variogram(
+    points, tree, variogram_model, *, k_neighbors=50, sample_size=5000, nlags=6
+):
+    """
+    用子样本点与其 k 近邻构成的点对拟合一次变差函数，返回 gamma(d)
+    只统计局部邻域尺度的点对，与逐像素局部拟合所见的滞后范围一致
+    gamma 可序列化，分瓦片并行时在主进程拟合一次后传给工作进程
+    少于 2 个点或点全部重合时没有可用的滞后距离，返回 None
+    """
+    if len(points) < MIN_VARIOGRAM_POINTS:
+        return None
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(points), min(sample_size, len(points)), replace=False)
+    dists, idxs = tree.query(points[sample, :2], k=min(k_neighbors, len(points)))
+    dz = points[idxs, 2] - points[sample, 2][:, None]
+    dists, semivariance = dists[:, 1:].ravel(), 0.5 * dz[:, 1:].ravel() ** 2
+    if not (dists > 0).any():
+        return None
+
+    edges = np.linspace(0, dists.max(), nlags + 1)
+    bins = np.clip(np.digitize(dists, edges) - 1, 0, nlags - 1)
+    counts = np.bincount(bins, minlength=nlags)
+    filled = counts > 0
+    lags = np.bincount(bins, dists, nlags)[filled] / counts[filled]
+    semivariance = np.bincount(bins, semivariance, nlags)[filled] / counts[filled]
+
+    variogram_function = OrdinaryKriging.variogram_dict[variogram_model]
+    params = _calculate_variogram_model(
+        lags, semivariance, variogram_model, variogram_function, False
+    )
+    return partial(variogram_function, params)
+
+
+def _krige_block(dists, idxs, points, gamma, min_points):
+    """批量求解一组网格点的局部普通克里金方程组"""
+    m, k = dists.shape
+    valid = np.isfinite(dists)
+    idxs = np.minimum(idxs, len(points) - 1)
+    local_xy = points[idxs, :2]
+    zs = points[idxs, 2]
+
+    # 组装 (m, k+1, k+1) 的克里金矩阵，无效邻居所在行列置为单位阵使其权重为 0
+    pair_d = np.linalg.norm(local_xy[:, :, None, :] - local_xy[:, None, :, :], axis=-1)
+    pair_valid = valid[:, :, None] & valid[:, None, :]
+    a = np.zeros((m, k + 1, k + 1))
+    a[:, :k, :k] = np.where(pair_valid, gamma(pair_d), 0.0)
+    a[:, np.arange(k), np.arange(k)] = np.where(valid, 0.0, 1.0)
+    a[:, :k, k] = valid
+    a[:, k, :k] = valid
+
+    b = np.zeros((m, k + 1))
+    b[:, :k] = np.where(valid, gamma(np.where(valid, dists, 0.0)), 0.0)
+    b[:, :k][dists == 0] = 0.0
+    b[:, k] = 1.0
+
+    try:
+        x = np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        x = (np.linalg.pinv(a) @ b[..., None])[..., 0]
+
+    z = np.sum(x[:, :k] * zs, axis=1)
+    sigmasq = np.sum(x * b, axis=1)
+    insufficient = np.sum(valid, axis=1) < min_points
+    z[insufficient] = np.nan
+    sigmasq[insufficient] = np.nan
+    return z, sigmasq
+
+
+def batched_kriging_interpolation(
+    points,
+    grid_x,
+    grid_y,
+    *,
+    k_neighbors=50,
+    max_distance=30.0,
+    min_points=3,
+    variogram_model="linear",
+    sample_size=5000,
+    block_size=1024,
+    n_jobs=os.cpu_count(),
+    tree=None,
+    gamma=None,
+):
+    """
+    共享变差函数的批量局部克里金插值
+    变差函数只在子样本上拟合一次，每 block_size 个网格点的局部方程组堆叠后一次求解
+    gamma 为已拟合的变差函数，为空时在子样本上拟合
+    返回 (dem, variance)，无法拟合变差函数时全部为 NaN
+    """
+    # print("Batched Local Kriging interpolation...")
+    if tree is None:
+        tree = cKDTree(points[:, :2])
+    if gamma is None:
+        gamma = fit_variogram(
+            points,
+            tree,
+            variogram_model,
+            k_neighbors=k_neighbors,
+            sample_size=sample_size,
+        )
+    flat_grid = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    dem = np.full(flat_grid.shape[0], np.nan)
+    variance = np.full(flat_grid.shape[0], np.nan)
+    if gamma is None:
+        return dem.reshape(grid_x.shape), variance.reshape(grid_x.shape)
+
+    for start in range(0, flat_grid.shape[0], block_size):
+        block = flat_grid[start : start + block_size]
+        dists, idxs = tree.query(
+            block,
+            k=k_neighbors,
+            distance_upper_bound=max_distance,
+            workers=n_jobs or -1,
+        )
+        dists = dists.reshape(len(block), -1)
+        idxs = idxs.reshape(len(block), -1)
+        z, sigmasq = _krige_block(dists, idxs, points, gamma, min_points)
+        dem[start : start + block_size] = z
+        variance[start : start + block_size] = sigmasq
+
+    return dem.reshape(grid_x.shape), variance.reshape(grid_x.shape)
+
+
 # IDW 插值
-def process_row_parallel(args):
-    i, grid_x_row, grid_y_row, points, k, power, min_points, tree = args
-    row_result = np.full(len(grid_x_row), np.nan)
-    for j in range(len(grid_x_row)):
-        gx, gy = grid_x_row[j], grid_y_row[j]
-        dists, idxs = tree.query([gx, gy], k=k)
-        if len(np.atleast_1d(idxs)) < min_points:
-            continue
-        neighbor_points = points[idxs]
-        zs = neighbor_points[:, 2]
-        dists = np.atleast_1d(dists)
-        dists[dists == 0] = 1e-12
-        weights = 1 / (dists**power)
-        row_result[j] = np.sum(weights * zs) / np.sum(weights)
-    return i, row_result
+def _idw_block(dists, zs, power, min_points):
+    """对一批网格点的 k 近邻结果做 IDW 加权，返回每个网格点的插值结果"""
+    valid = np.isfinite(dists)
+    dem = np.full(dists.shape[0], np.nan)
+
+    # 与邻居重合的网格点直接取重合点高程的均值
+    zero = valid & (dists == 0)
+    has_zero = zero.any(axis=1)
+    if has_zero.any():
+        zero_sum = np.sum(np.where(zero, zs, 0.0), axis=1)
+        dem[has_zero] = zero_sum[has_zero] / np.sum(zero, axis=1)[has_zero]
+
+    rest = ~has_zero & (np.sum(valid, axis=1) >= min_points)
+    if rest.any():
+        with np.errstate(divide="ignore"):
+            weights = np.where(valid[rest], 1.0 / dists[rest] ** power, 0.0)
+        dem[rest] = np.sum(weights * zs[rest], axis=1) / np.sum(weights, axis=1)
+    return dem
 
 
 def idw_interpolation(
-    points, grid_x, grid_y, power=2, k=10, min_points=3, n_jobs=os.cpu_count()
+    points,
+    grid_x,
+    grid_y,
+    *,
+    power=2,
+    k=10,
+    min_points=3,
+    block_size=65536,
+    n_jobs=os.cpu_count(),
+    tree=None,
 ):
-    # print("IDW interpolation (multiprocessing)...")
-    dem = np.full(grid_x.shape, np.nan)
-    rows, cols = grid_x.shape
+    """
+    分块批量 IDW 插值
+    每次对 block_size 个网格点调用一次 cKDTree.query，内存占用约为 block_size * k
+    """
+    # print("IDW interpolation (batched)...")
+    if tree is None:
+        tree = cKDTree(points[:, :2])
+    flat_grid = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    dem = np.full(flat_grid.shape[0], np.nan)
 
-    # 建立 KDTree
-    xy = points[:, :2]
-    tree = cKDTree(xy)
+    for start in range(0, flat_grid.shape[0], block_size):
+        block = flat_grid[start : start + block_size]
+        dists, idxs = tree.query(block, k=k, workers=n_jobs or -1)
+        dists = dists.reshape(len(block), -1)
+        idxs = idxs.reshape(len(block), -1)
+        # 点数不足 k 时缺失的邻居索引为 len(points)，距离为 inf
+        zs = points[np.minimum(idxs, len(points) - 1), 2]
+        dem[start : start + block_size] = _idw_block(dists, zs, power, min_points)
 
-    # 分配每一行的任务（注意只传递每行的小量数据）
-    tasks = [
-        (i, grid_x[i, :], grid_y[i, :], points, k, power, min_points, tree)
-        for i in range(rows)
-    ]
+    return dem.reshape(grid_x.shape)
 
-    with Pool(processes=n_jobs) as pool:
-        for i, row_result in pool.imap_unordered(process_row_parallel, tasks):
-            dem[i, :] = row_result
 
-    return dem
+# Delaunay 三角网插值
+def _circumcenters(a, b, c):
+    """三角形 (a, b, c) 的外接圆圆心，坐标形状为 (..., 2)"""
+    ax, ay, bx, by, cx, cy = (
+        a[..., 0],
+        a[..., 1],
+        b[..., 0],
+        b[..., 1],
+        c[..., 0],
+        c[..., 1],
+    )
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    a2, b2, c2 = ax**2 + ay**2, bx**2 + by**2, cx**2 + cy**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+        uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return np.stack((ux, uy), axis=-1)
+
+
+def _signed_area(a, b, c):
+    return 0.5 * (
+        (b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1])
+        - (c[..., 0] - a[..., 0]) * (b[..., 1] - a[..., 1])
+    )
+
+
+class Triangulation:
+    """
+    点云平面坐标的 Delaunay 三角网，外接圆在自然邻域插值首次用到时计算
+    构建代价高，由 DemService 按点云缓存，改变网格大小或范围重新插值时复用
+    """
+
+    def __init__(self, points):
+        self.delaunay = Delaunay(points[:, :2])
+
+    @cached_property
+    def circumcircles(self):
+        """各三角形的外接圆 (圆心, 半径平方)"""
+        vertices = self.delaunay.points[self.delaunay.simplices]
+        centers = _circumcenters(vertices[:, 0], vertices[:, 1], vertices[:, 2])
+        return centers, np.sum((vertices[:, 0] - centers) ** 2, axis=-1)
+
+    def barycentric(self, simplex, xy):
+        """xy 在各自所在三角形 simplex 中的重心坐标 (m, 3)"""
+        vertices = self.delaunay.points[self.delaunay.simplices[simplex]]
+        v0 = vertices[:, 1] - vertices[:, 0]
+        v1 = vertices[:, 2] - vertices[:, 0]
+        v2 = xy - vertices[:, 0]
+        den = v0[:, 0] * v1[:, 1] - v1[:, 0] * v0[:, 1]
+        l1 = (v2[:, 0] * v1[:, 1] - v1[:, 0] * v2[:, 1]) / den
+        l2 = (v0[:, 0] * v2[:, 1] - v2[:, 0] * v0[:, 1]) / den
+        return np.column_stack((1 - l1 - l2, l1, l2))
+
+    def cavity(self, xy, simplex):
+        """
+        Bowyer-Watson 空腔：外接圆包含查询点的所有三角形
+        从查询点所在三角形出发沿相邻三角形逐层扩展，所有查询点同时处理
+        返回 (查询点下标, 三角形下标) 对
+        """
+        centers, radii_sq = self.circumcircles
+        neighbors = self.delaunay.neighbors
+        count = len(radii_sq)
+        queries = np.flatnonzero(simplex >= 0)
+        triangles = simplex[queries]
+        found_q, found_t = [queries], [triangles]
+        visited = queries.astype(np.int64) * count + triangles
+        while len(queries):
+            queries = np.repeat(queries, 3)
+            triangles = neighbors[triangles].ravel()
+            keep = triangles >= 0
+            queries, triangles = queries[keep], triangles[keep]
+            inside = (
+                np.sum((xy[queries] - centers[triangles]) ** 2, axis=-1)
+                < radii_sq[triangles]
+            )
+            keys = queries[inside].astype(np.int64) * count + triangles[inside]
+            keys = np.setdiff1d(keys, visited)
+            visited = np.concatenate((visited, keys))
+            queries, triangles = keys // count, keys % count
+            found_q.append(queries)
+            found_t.append(triangles)
+        return np.concatenate(found_q), np.concatenate(found_t)
+
 
+def triangulate(points):
+    """点云的 Delaunay 三角网，少于 3 个点或全部共线等退化情况返回 None"""
+    if len(points) < MIN_TRIANGLE_POINTS:
+        return None
+    try:
+        return Triangulation(points)
+    except QhullError:
+        return None
 
-# 并行最近邻颜色插值
-def _query_nearest(idx, flat_grid, tree, colors):
-    dist, nearest_idx = tree.query(flat_grid[idx])
-    return idx, colors[nearest_idx]
 
+def tin_linear_interpolation(
+    points, grid_x, grid_y, *, triangulation=None, block_size=65536
+):
+    """
+    TIN 线性插值：分块批量定位网格点所在的三角形，用重心坐标一次加权
+    凸包外的网格点为 NaN，无法构建三角网时全部为 NaN
+    """
+    if triangulation is None:
+        triangulation = triangulate(points)
+    if triangulation is None:
+        return np.full(grid_x.shape, np.nan)
+    simplices = triangulation.delaunay.simplices
+    flat_grid = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    dem = np.full(flat_grid.shape[0], np.nan)
+
+    for start in range(0, flat_grid.shape[0], block_size):
+        block = flat_grid[start : start + block_size]
+        simplex = triangulation.delaunay.find_simplex(block)
+        inside = simplex >= 0
+        weights = triangulation.barycentric(simplex[inside], block[inside])
+        zs = points[simplices[simplex[inside]], 2]
+        dem[start : start + block_size][inside] = np.sum(weights * zs, axis=1)
+
+    return dem.reshape(grid_x.shape)
+
+
+def natural_neighbor_interpolation(
+    points, grid_x, grid_y, *, triangulation=None, block_size=65536
+):
+    """
+    Sibson 自然邻域插值（Watson 方法）：对空腔中的每个三角形，
+    由其外接圆圆心与查询点和各边构成的三角形外接圆圆心，
+    计算查询点从各顶点 Voronoi 区域"偷取"的面积作为权重
+    与数据点重合等退化情况退回 TIN 线性插值，凸包外的网格点为 NaN，
+    无法构建三角网时全部为 NaN
+    """
+    if triangulation is None:
+        triangulation = triangulate(points)
+    if triangulation is None:
+        return np.full(grid_x.shape, np.nan)
+    simplices = triangulation.delaunay.simplices
+    centers, _ = triangulation.circumcircles
+    xy = triangulation.delaunay.points
+    flat_grid = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    dem = np.full(flat_grid.shape[0], np.nan)
 
-def nearest_color_interpolation(points, colors, grid_x, grid_y, n_jobs=os.cpu_count()):
+    for start in range(0, flat_grid.shape[0], block_size):
+        block = flat_grid[start : start + block_size]
+        simplex = triangulation.delaunay.find_simplex(block)
+        queries, triangles = triangulation.cavity(block, simplex)
+
+        # 以查询点为原点计算，g[i] 为查询点与顶点 i 对边构成的三角形的外接圆圆心
+        vertices = simplices[triangles]
+        local = xy[vertices] - block[queries][:, None, :]
+        center = centers[triangles] - block[queries]
+        origin = np.zeros_like(center)
+        g = [
+            _circumcenters(origin, local[:, (i + 1) % 3], local[:, (i + 2) % 3])
+            for i in range(3)
+        ]
+        weights = np.column_stack(
+            [_signed_area(center, g[(i + 1) % 3], g[(i + 2) % 3]) for i in range(3)]
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            numerator = np.bincount(
+                queries, np.sum(weights * points[vertices, 2], axis=1), len(block)
+            )
+            values = numerator / np.bincount(queries, weights.sum(axis=1), len(block))
+
+        inside = simplex >= 0
+        linear = np.full(len(block), np.nan)
+        linear[inside] = np.sum(
+            triangulation.barycentric(simplex[inside], block[inside])
+            * points[simplices[simplex[inside]], 2],
+            axis=1,
+        )
+        dem[start : start + block_size] = np.where(
+            inside & np.isfinite(values), values, linear
+        )
+
+    return dem.reshape(grid_x.shape)
+
+
+# 分箱统计插值
+def _grid_axis(values):
+    """规则网格坐标轴的起点与间距，单个网格点时间距取 1"""
+    step = values[1] - values[0] if len(values) > 1 else 1.0
+    return values[0], step or 1.0
+
+
+def bin_points(points, grid_x, grid_y):
+    """
+    把每个点分配到最近的网格节点，返回 (扁平网格下标, 网格内的点)
+    grid_x, grid_y 为规则网格的 meshgrid，落在网格范围外的点被丢弃
+    """
+    x0, dx = _grid_axis(grid_x[0])
+    y0, dy = _grid_axis(grid_y[:, 0])
+    height, width = grid_x.shape
+    cols = np.rint((points[:, 0] - x0) / dx).astype(np.int64)
+    rows = np.rint((points[:, 1] - y0) / dy).astype(np.int64)
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    return rows[inside] * width + cols[inside], inside
+
+
+def _bin_statistic(cells, z, size, statistic):
+    """按网格下标归约高程，返回 (统计值, 点数)，空网格为 NaN"""
+    counts = np.bincount(cells, minlength=size)
+    occupied = counts > 0
+    values = np.full(size, np.nan)
+    if statistic == "mean":
+        values[occupied] = np.bincount(cells, z, size)[occupied] / counts[occupied]
+    elif statistic in ("min", "max"):
+        reduced = np.full(size, np.inf if statistic == "min" else -np.inf)
+        (np.minimum if statistic == "min" else np.maximum).at(reduced, cells, z)
+        values[occupied] = reduced[occupied]
+    else:
+        # 以 "网格下标 + 归一化高程" 为键排序一次，同一网格内的点按高程有序
+        span = np.ptp(z) if len(z) else 0.0
+        key = cells + (z - z.min()) / (2 * span) if span > 0 else cells
+        order = np.argsort(key, kind="stable")
+        sorted_z = z[order]
+        starts = np.concatenate(([0], np.cumsum(counts[occupied])[:-1]))
+        n = counts[occupied]
+        values[occupied] = (
+            sorted_z[starts + (n - 1) // 2] + sorted_z[starts + n // 2]
+        ) / 2
+    return values, counts
+
+
+def binning_interpolation(
+    points,
+    grid_x,
+    grid_y,
+    *,
+    statistic="mean",
+    fill="idw",
+    power=2,
+    k=10,
+    block_size=65536,
+    n_jobs=os.cpu_count(),
+):
+    """
+    分箱统计插值：一次向量化遍历把点分配到最近的网格节点，按网格统计高程
+    点密度高于网格分辨率时只需 O(N) 的归约，不做逐网格的近邻查询；
+    fill="idw" 时以有点网格为样本，只对空网格做 IDW 补洞
+    返回 (dem, density)，density 为每个网格内的点数
+    """
+    cells, inside = bin_points(points, grid_x, grid_y)
+    values, counts = _bin_statistic(cells, points[inside, 2], grid_x.size, statistic)
+    flat_x, flat_y = grid_x.ravel(), grid_y.ravel()
+    holes = counts == 0
+    if fill == "idw" and holes.any() and not holes.all():
+        samples = np.column_stack((flat_x[~holes], flat_y[~holes], values[~holes]))
+        values[holes] = idw_interpolation(
+            samples,
+            flat_x[holes],
+            flat_y[holes],
+            power=power,
+            k=min(k, len(samples)),
+            min_points=1,
+            block_size=block_size,
+            n_jobs=n_jobs,
+        )
+    return values.reshape(grid_x.shape), counts.astype(np.int32).reshape(grid_x.shape)
+
+
+def binning_color_interpolation(
+    points,
+    colors,
+    grid_x,
+    grid_y,
+    *,
+    block_size=65536,
+    n_jobs=os.cpu_count(),
+):
+    """按网格取点颜色的均值，空网格取最近的有点网格的颜色"""
+    colors = _unit_colors(colors)
+    cells, inside = bin_points(points, grid_x, grid_y)
+    counts = np.bincount(cells, minlength=grid_x.size)
+    occupied = counts > 0
+    color_grid = np.zeros((grid_x.size, 3), dtype=np.float32)
+    for c in range(3):
+        color_grid[occupied, c] = (
+            np.bincount(cells, colors[inside, c], grid_x.size)[occupied]
+            / counts[occupied]
+        )
+    color_grid = np.clip(color_grid * 255, 0, 255).astype(np.uint8)
+    holes = ~occupied
+    if holes.any() and occupied.any():
+        flat_x, flat_y = grid_x.ravel(), grid_y.ravel()
+        color_grid[holes] = nearest_color_interpolation(
+            np.column_stack((flat_x[occupied], flat_y[occupied])),
+            color_grid[occupied],
+            flat_x[holes],
+            flat_y[holes],
+            block_size=block_size,
+            n_jobs=n_jobs,
+        )
+    return color_grid.reshape(grid_x.shape + (3,))
+
+
+# 最近邻 / k 近邻加权颜色插值
+def _unit_colors(colors):
+    """归一化颜色到0~1"""
+    if colors.dtype == np.uint8:
+        return colors.astype(np.float32) / 255.0
+    colors = colors.astype(np.float32)
+    if colors.max() > UNIT_COLOR_MAX:
+        colors = colors / 255.0
+    return colors
+
+
+def _blend_colors(dists, idxs, colors, power):
+    """按反距离权重混合 k 个近邻的颜色，与邻居重合的网格点直接取重合点颜色"""
+    valid = np.isfinite(dists)
+    zero = valid & (dists == 0)
+    with np.errstate(divide="ignore"):
+        weights = np.where(valid, 1.0 / dists**power, 0.0)
+    weights = np.where(zero.any(axis=1, keepdims=True), zero, weights)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("mk,mkc->mc", weights, colors[idxs])
+
+
+def nearest_color_interpolation(
+    points,
+    colors,
+    grid_x,
+    grid_y,
+    *,
+    k=1,
+    power=2,
+    block_size=65536,
+    n_jobs=os.cpu_count(),
+    tree=None,
+):
     """
     points: (N, 2)
     colors: (N, 3) float32 in 0~1 or uint8 in 0~255
     grid_x, grid_y: meshgrid
+    k: 1 为最近邻取色，大于 1 时按反距离权重混合 k 个近邻的颜色
     """
-    # print("Parallel Nearest Neighbor color interpolation...")
-
-    # 归一化颜色到0~1
-    if colors.dtype == np.uint8:
-        colors = colors.astype(np.float32) / 255.0
-    else:
-        colors = colors.astype(np.float32)
-        if colors.max() > 1.1:
-            colors = colors / 255.0
+    # print("Batched Nearest Neighbor color interpolation...")
 
+    colors = _unit_colors(colors)
     flat_grid = np.column_stack((grid_x.ravel(), grid_y.ravel()))
-    grid_shape = grid_x.shape
-    color_grid = np.full(grid_shape + (3,), np.nan, dtype=np.float32)
+    color_grid = np.empty((flat_grid.shape[0], 3), dtype=np.float32)
 
-    tree = cKDTree(points[:, :2])
+    if tree is None:
+        tree = cKDTree(points[:, :2])
+    k = min(k, len(points))
 
-    results = Parallel(n_jobs=n_jobs, prefer="threads", verbose=0)(
-        delayed(_query_nearest)(idx, flat_grid, tree, colors)
-        for idx in range(flat_grid.shape[0])
-    )
-
-    for idx, color in results:
-        i, j = np.unravel_index(idx, grid_shape)
-        color_grid[i, j] = color
+    for start in range(0, flat_grid.shape[0], block_size):
+        block = flat_grid[start : start + block_size]
+        dists, idxs = tree.query(block, k=k, workers=n_jobs or -1)
+        if k == 1:
+            color_grid[start : start + block_size] = colors[idxs]
+        else:
+            color_grid[start : start + block_size] = _blend_colors(
+                dists, idxs, colors, power
+            )
 
-    color_grid = np.clip(color_grid * 255, 0, 255)
-    color_grid = np.nan_to_num(color_grid, nan=0).astype(np.uint8)
-    return color_grid
+    color_grid = np.clip(color_grid * 255, 0, 255).astype(np.uint8)
+    return color_grid.reshape(grid_x.shape + (3,))
@@ -0,0 +1,90 @@
+import numpy as np
+import open3d as o3d
+from scipy import ndimage
+
+
+def _to_o3d(points: np.ndarray, colors: np.ndarray | None):
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    if colors is not None:
+        pcd.colors = o3d.utility.Vector3dVector(colors)
+    return pcd
+
+
+def _from_o3d(pcd, has_colors: bool):
+    points = np.asarray(pcd.points)
+    colors = np.asarray(pcd.colors) if has_colors else None
+    return points, colors
+
+
+def voxel_downsample(points: np.ndarray, colors: np.ndarray | None, voxel_size: float):
+    """体素网格下采样，每个体素内的点（与颜色）取平均"""
+    pcd = _to_o3d(points, colors).voxel_down_sample(voxel_size)
+    return _from_o3d(pcd, colors is not None)
+
+
+def remove_statistical_outliers(
+    points: np.ndarray,
+    colors: np.ndarray | None,
+    neighbors: int,
+    std_ratio: float,
+):
+    """剔除到 k 近邻平均距离超出全局均值 std_ratio 倍标准差的点"""
+    _, index = _to_o3d(points, None).remove_statistical_outlier(neighbors, std_ratio)
+    index = np.asarray(index)
+    return points[index], None if colors is None else colors[index]
+
+
+def remove_radius_outliers(
+    points: np.ndarray,
+    colors: np.ndarray | None,
+    neighbors: int,
+    radius: float,
+):
+    """剔除 radius 半径内邻居少于 neighbors 个的点"""
+    _, index = _to_o3d(points, None).remove_radius_outlier(neighbors, radius)
+    index = np.asarray(index)
+    return points[index], None if colors is None else colors[index]
+
+
+def ground_mask(
+    points: np.ndarray,
+    *,
+    cell_size: float,
+    max_window: float,
+    slope: float,
+    initial_distance: float,
+    max_distance: float,
+):
+    """
+    渐进形态学滤波（Zhang et al. 2003）的栅格化实现，返回地面点的布尔掩码
+    在最低点栅格上以指数增长的窗口做形态学开运算，
+    高出开运算表面超过随窗口增大的阈值的点判为非地面点（植被、建筑等）
+    """
+    ij = np.floor((points[:, :2] - points[:, :2].min(axis=0)) / cell_size).astype(
+        np.intp
+    )
+    shape = tuple(ij.max(axis=0) + 1)
+    z = points[:, 2]
+    surface = np.full(shape, np.inf)
+    np.minimum.at(surface, (ij[:, 0], ij[:, 1]), z)
+    # 空栅格取最近的有点栅格的高程
+    empty = np.isinf(surface)
+    if empty.any():
+        nearest = ndimage.distance_transform_edt(
+            empty, return_distances=False, return_indices=True
+        )
+        surface = surface[tuple(nearest)]
+
+    ground = np.ones(len(points), dtype=bool)
+    max_cells = max(int(max_window / cell_size), 1)
+    previous = 1
+    k = 1
+    while (window := 2 * 2 ** (k - 1) + 1) <= 2 * max_cells + 1:
+        surface = ndimage.grey_opening(surface, size=(window, window))
+        threshold = min(
+            initial_distance + slope * (window - previous) * cell_size, max_distance
+        )
+        ground &= z - surface[ij[:, 0], ij[:, 1]] <= threshold
+        previous = window
+        k += 1
+    return ground
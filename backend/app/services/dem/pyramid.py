@@ -0,0 +1,96 @@
+import math
+from typing import Literal
+
+import numpy as np
+from affine import Affine
+
+Pooling = Literal["mean", "min", "max", "decimate"]
+
+
+def _pool_elevation(dem: np.ndarray, pooling: Pooling):
+    """2x2 池化高程，忽略 NaN；奇数边长用 NaN 补齐"""
+    if pooling == "decimate":
+        return dem[::2, ::2]
+    height, width = dem.shape
+    padded = np.pad(
+        dem, ((0, height % 2), (0, width % 2)), constant_values=np.nan
+    ).reshape((height + 1) // 2, 2, (width + 1) // 2, 2)
+    if pooling == "min":
+        return np.fmin.reduce(padded, axis=(1, 3))
+    if pooling == "max":
+        return np.fmax.reduce(padded, axis=(1, 3))
+    finite = np.isfinite(padded)
+    counts = finite.sum(axis=(1, 3))
+    sums = np.where(finite, padded, 0.0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan).astype(dem.dtype)
+
+
+def _pool_colors(color_grid: np.ndarray, pooling: Pooling):
+    """2x2 池化颜色 (height, width, 3)，min/max 池化时颜色直接抽稀"""
+    if pooling != "mean":
+        return color_grid[::2, ::2]
+    height, width, _ = color_grid.shape
+    padded = np.pad(
+        color_grid, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge"
+    ).reshape((height + 1) // 2, 2, (width + 1) // 2, 2, 3)
+    return padded.mean(axis=(1, 3), dtype=np.float32).astype(np.uint8)
+
+
+class DemPyramid:
+    """
+    DEM 四叉树金字塔，z=0 为覆盖全图的单张瓦片，z=max_zoom 为原始分辨率
+    """
+
+    def __init__(
+        self,
+        dem: np.ndarray,
+        color_grid: np.ndarray | None,
+        tile_size: int = 256,
+        pooling: Pooling = "mean",
+    ):
+        self.tile_size = tile_size
+        self.max_zoom = max(0, math.ceil(math.log2(max(dem.shape) / tile_size)))
+        # levels[z] = (高程, 颜色)，从原始分辨率逐级池化
+        levels = [(dem, color_grid)]
+        for _ in range(self.max_zoom):
+            dem = _pool_elevation(dem, pooling)
+            if color_grid is not None:
+                color_grid = _pool_colors(color_grid, pooling)
+            levels.append((dem, color_grid))
+        self.levels = levels[::-1]
+
+    def level_shape(self, z: int):
+        return self.levels[z][0].shape
+
+    def tile_count(self, z: int):
+        height, width = self.level_shape(z)
+        return math.ceil(width / self.tile_size), math.ceil(height / self.tile_size)
+
+    def tile(self, z: int, x: int, y: int):
+        """
+        返回 (高程, 颜色) 视图，颜色为 (3, height, width)
+        边缘瓦片可能小于 tile_size
+        """
+        if not 0 <= z <= self.max_zoom:
+            raise IndexError(f"Zoom level {z} out of range")
+        nx, ny = self.tile_count(z)
+        if not (0 <= x < nx and 0 <= y < ny):
+            raise IndexError(f"Tile {z}/{x}/{y} out of range")
+        dem, color_grid = self.levels[z]
+        rows = slice(y * self.tile_size, (y + 1) * self.tile_size)
+        cols = slice(x * self.tile_size, (x + 1) * self.tile_size)
+        rgb = None
+        if color_grid is not None:
+            rgb = np.transpose(color_grid[rows, cols], (2, 0, 1))
+        return dem[rows, cols], rgb
+
+    def tile_transform(self, transform: Affine, z: int, x: int, y: int):
+        """由原始分辨率的仿射变换计算瓦片的仿射变换"""
+        factor = 2 ** (self.max_zoom - z)
+        offset = self.tile_size * factor
+        return (
+            transform
+            * Affine.translation(x * offset, y * offset)
+            * Affine.scale(factor)
+        )
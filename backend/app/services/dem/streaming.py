@@ -0,0 +1,197 @@
+import math
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+
+# PLY 属性类型到 numpy 类型的映射
+PLY_DTYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
+}
+
+# 估算内存时每个点占用的字节数（坐标、颜色、KD 树与索引开销）
+BYTES_PER_POINT = 128
+
+
+def read_ply_header(ply_path: str):
+    """解析二进制 PLY 头，返回 (顶点数, 顶点结构化 dtype, 顶点数据偏移)"""
+    with open(ply_path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"Not a PLY file: {ply_path}")
+        byteorder = None
+        elements: list[tuple[str, int, list[tuple[str, str]]]] = []
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"Truncated PLY header: {ply_path}")
+            tokens = line.decode("ascii").split()
+            if not tokens or tokens[0] in {"comment", "obj_info"}:
+                continue
+            if tokens[0] == "format":
+                if tokens[1] == "ascii":
+                    raise ValueError("Streaming requires a binary PLY file")
+                byteorder = "<" if tokens[1] == "binary_little_endian" else ">"
+            elif tokens[0] == "element":
+                elements.append((tokens[1], int(tokens[2]), []))
+            elif tokens[0] == "property":
+                if tokens[1] == "list":
+                    raise ValueError("PLY list properties are not supported")
+                elements[-1][2].append((tokens[2], byteorder + PLY_DTYPES[tokens[1]]))
+            elif tokens[0] == "end_header":
+                offset = f.tell()
+                break
+
+    # 顶点之前的元素只能是定长的，跳过它们
+    for name, count, properties in elements:
+        dtype = np.dtype(properties)
+        if name == "vertex":
+            return count, dtype, offset
+        offset += count * dtype.itemsize
+    raise ValueError(f"PLY file has no vertex element: {ply_path}")
+
+
+def read_ply_chunks(
+    ply_path: str, chunk_size: int
+) -> Iterator[tuple[np.ndarray, np.ndarray | None]]:
+    """
+    通过内存映射分块读取二进制 PLY 的顶点
+    每块返回 (xyz float64 (n, 3), rgb uint8 (n, 3) 或 None)
+    """
+    count, dtype, offset = read_ply_header(ply_path)
+    vertices = np.memmap(ply_path, dtype=dtype, mode="r", offset=offset, shape=count)
+    has_colors = all(c in dtype.names for c in ("red", "green", "blue"))  # type: ignore[operator]
+    for start in range(0, count, chunk_size):
+        chunk = vertices[start : start + chunk_size]
+        xyz = np.column_stack((chunk["x"], chunk["y"], chunk["z"])).astype(np.float64)
+        rgb = None
+        if has_colors:
+            rgb = np.column_stack((chunk["red"], chunk["green"], chunk["blue"]))
+            rgb = rgb.astype(np.uint8)
+        yield xyz, rgb
+    del vertices
+
+
+class TileBuckets:
+    """
+    将点云按输出瓦片（含 halo 边缘）分桶写入临时文件
+    瓦片按行列编号，行方向从北向南
+    """
+
+    def __init__(
+        self,
+        bounds: tuple[float, float, float, float],
+        resolution: tuple[float, float],
+        shape: tuple[int, int],
+        tile_size: int,
+        halo: int,
+    ):
+        self.min_x, self.min_y, self.max_x, self.max_y = bounds
+        self.xres, self.yres = resolution
+        self.height, self.width = shape
+        self.tile_size = tile_size
+        self.tiles_x = math.ceil(self.width / tile_size)
+        self.tiles_y = math.ceil(self.height / tile_size)
+        self.halo_x = halo * self.xres
+        self.halo_y = halo * self.yres
+        self._dir = tempfile.TemporaryDirectory(prefix="dem_buckets_")
+        self.has_colors = False
+
+    def _path(self, tile_id: int, kind: str):
+        return Path(self._dir.name) / f"{tile_id}.{kind}"
+
+    def _tile_coords(self, xyz: np.ndarray):
+        """点所在的瓦片列、行（以瓦片边长为单位的小数）"""
+        col = (xyz[:, 0] - self.min_x) / (self.tile_size * self.xres)
+        row = (self.max_y - xyz[:, 1]) / (self.tile_size * self.yres)
+        return col, row
+
+    def in_core(self, xyz: np.ndarray, tile_x: int, tile_y: int):
+        """点是否位于瓦片本身而非 halo 中，每个点只属于一个瓦片的核心区域"""
+        col, row = self._tile_coords(xyz)
+        return (np.clip(np.floor(col), 0, self.tiles_x - 1) == tile_x) & (
+            np.clip(np.floor(row), 0, self.tiles_y - 1) == tile_y
+        )
+
+    def add(self, xyz: np.ndarray, rgb: np.ndarray | None):
+        tile_w = self.tile_size * self.xres
+        tile_h = self.tile_size * self.yres
+        col, row = self._tile_coords(xyz)
+        halo_col, halo_row = self.halo_x / tile_w, self.halo_y / tile_h
+        col_range = [
+            np.clip(np.floor(col + d), 0, self.tiles_x - 1).astype(np.int64)
+            for d in (-halo_col, halo_col)
+        ]
+        row_range = [
+            np.clip(np.floor(row + d), 0, self.tiles_y - 1).astype(np.int64)
+            for d in (-halo_row, halo_row)
+        ]
+
+        # halo 小于瓦片宽度，每个点最多落入 2x2 个瓦片
+        ids, members = [], []
+        for i, rows in enumerate(row_range):
+            for j, cols in enumerate(col_range):
+                keep = np.ones(len(xyz), dtype=bool)
+                if i == 1:
+                    keep &= rows != row_range[0]
+                if j == 1:
+                    keep &= cols != col_range[0]
+                ids.append((rows * self.tiles_x + cols)[keep])
+                members.append(np.nonzero(keep)[0])
+        tile_ids = np.concatenate(ids)
+        point_idx = np.concatenate(members)
+
+        order = np.argsort(tile_ids, kind="stable")
+        tile_ids, point_idx = tile_ids[order], point_idx[order]
+        unique_ids, starts = np.unique(tile_ids, return_index=True)
+        for tile_id, idx in zip(unique_ids, np.split(point_idx, starts[1:])):
+            with open(self._path(tile_id, "xyz"), "ab") as f:
+                xyz[idx].tofile(f)
+            if rgb is not None:
+                with open(self._path(tile_id, "rgb"), "ab") as f:
+                    rgb[idx].tofile(f)
+        self.has_colors = rgb is not None
+
+    def load(self, tile_x: int, tile_y: int):
+        """读取一个瓦片桶内的点，返回 (xyz, rgb)，空瓦片返回 (None, None)"""
+        tile_id = tile_y * self.tiles_x + tile_x
+        path = self._path(tile_id, "xyz")
+        if not path.exists():
+            return None, None
+        xyz = np.fromfile(path, dtype=np.float64).reshape(-1, 3)
+        rgb = None
+        if self.has_colors:
+            rgb = np.fromfile(self._path(tile_id, "rgb"), dtype=np.uint8).reshape(-1, 3)
+        return xyz, rgb
+
+    def cleanup(self):
+        self._dir.cleanup()
+
+
+def plan_streaming(point_count: int, grid_cells: int, memory_budget: int, block: int):
+    """
+    根据内存预算估算每次读取的点数和瓦片边长（block 的整数倍）
+    一半预算用于读取分块，一半用于单个瓦片的插值
+    瓦片边长不小于 block，点密度很高时单个瓦片的点数会超出预算
+    """
+    chunk_size = max(1, memory_budget // 2 // BYTES_PER_POINT)
+    points_per_tile = memory_budget // 2 // BYTES_PER_POINT
+    density = point_count / max(grid_cells, 1)
+    tile_cells = points_per_tile / max(density, 1e-12)
+    tile_size = max(block, int(math.sqrt(tile_cells)) // block * block)
+    return chunk_size, tile_size
@@ -0,0 +1,90 @@
+import gzip
+import json
+import struct
+from typing import Literal
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖
+    zstandard = None
+
+ElevationDtype = Literal["float32", "float16", "uint16"]
+Compression = Literal["none", "gzip", "zstd"]
+
+NODATA = -32768.0
+
+
+def _encode_elevation(
+    elevation: np.ndarray, dtype: ElevationDtype, nodata_mask: np.ndarray | None
+):
+    """按指定格式编码高程，返回 (小端字节, 头信息)"""
+    if nodata_mask is None:
+        nodata_mask = ~np.isfinite(elevation)
+    if dtype == "uint16":
+        # 16 位量化：0 表示无数据，有效值映射到 1~65535
+        valid = elevation[~nodata_mask]
+        offset = float(valid.min()) if valid.size else 0.0
+        span = float(valid.max()) - offset if valid.size else 0.0
+        scale = span / 65534 if span > 0 else 1.0
+        quantized = np.round((elevation - offset) / scale) + 1
+        quantized[nodata_mask] = 0
+        data = quantized.astype("<u2")
+        return data.tobytes(), {"nodata": 0, "scale": scale, "offset": offset - scale}
+
+    data = elevation.astype("<f4" if dtype == "float32" else "<f2")
+    data[nodata_mask] = NODATA
+    return data.tobytes(), {"nodata": NODATA, "scale": 1.0, "offset": 0.0}
+
+
+def compress(payload: bytes, compression: Compression):
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=1)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    return payload
+
+
+def encode_dem_binary(
+    profile,
+    elevation,
+    rgb,
+    dtype: ElevationDtype = "float32",
+    nodata_mask: np.ndarray | None = None,
+) -> bytes:
+    """
+    将 DEM 编码为二进制：
+    [uint32 头长度][JSON 头][高程 (height, width)][RGB (height, width, 3) uint8]
+    量化高程按 value = offset + q * scale 还原；nodata_mask 为空时以非有限值为无数据
+    """
+    elevation_bytes, elevation_header = _encode_elevation(elevation, dtype, nodata_mask)
+    if rgb is not None:
+        # (3, height, width) -> (height, width, 3)
+        texture_bytes = np.ascontiguousarray(
+            np.transpose(rgb, (1, 2, 0)), dtype=np.uint8
+        ).tobytes()
+    else:
+        texture_bytes = b""
+
+    header = json.dumps(
+        {
+            "width": profile["width"],
+            "height": profile["height"],
+            "crs": profile["crs"],
+            "resolution": {
+                "x": abs(profile["transform"][0]),
+                "y": abs(profile["transform"][4]),
+            },
+            "dtype": dtype,
+            "byteorder": "little",
+            "elevation_bytes": len(elevation_bytes),
+            "texture_bytes": len(texture_bytes),
+            **elevation_header,
+        }
+    ).encode()
+    return b"".join(
+        (struct.pack("<I", len(header)), header, elevation_bytes, texture_bytes)
+    )
@@ -0,0 +1,139 @@
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree  # type: ignore[import-not-found]
+
+from ..cpu import worker_count
+
+# 工作进程内最近一次映射的点云 (文件路径, 点, KD 树)
+_worker_cloud: tuple[str, np.ndarray, cKDTree] | None = None
+
+
+def _worker_points(path: str):
+    """只读映射点云文件，同一点云的 KD 树在工作进程内只建立一次"""
+    global _worker_cloud  # noqa: PLW0603
+    if _worker_cloud is None or _worker_cloud[0] != path:
+        _worker_cloud = None
+        points = np.load(path, mmap_mode="r")
+        _worker_cloud = (path, points, cKDTree(points[:, :2]))
+    return _worker_cloud[1:]
+
+
+def _tile_job(func, path: str, x: np.ndarray, y: np.ndarray, kwargs: dict):
+    points, tree = _worker_points(path)
+    grid_x, grid_y = np.meshgrid(x, y)
+    return func(points, grid_x, grid_y, tree=tree, **kwargs)
+
+
+class DemWorkerPool:
+    """
+    dem 包共用的常驻进程池，首次用于克里金插值时创建，之后在多次生成之间复用
+    点云写入内存映射的 .npy 文件，工作进程按路径只读映射，不逐任务序列化点云；
+    网格按 tile_size 划分为空间瓦片分发，每个任务只传递瓦片的坐标轴
+    每次共享的点云写入新文件，旧文件在工作进程不再映射后删除，
+    Windows 上无法删除仍被映射的文件
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._dir = tempfile.TemporaryDirectory(prefix="dem_shared_")
+        # 当前共享的点云 (数组, 文件路径)，同一数组对象重复使用时不再写入
+        self._shared: tuple[np.ndarray, str] | None = None
+        self._generation = 0
+        # 已被替换、等待删除的点云文件
+        self._stale: list[Path] = []
+        self._lock = threading.Lock()
+
+    def share(self, points: np.ndarray):
+        with self._lock:
+            if self._shared is not None and self._shared[0] is points:
+                return self._shared[1]
+            self._generation += 1
+            path = str(Path(self._dir.name) / f"cloud_{self._generation:05d}.npy")
+            np.save(path, np.ascontiguousarray(points))
+            if self._shared is not None:
+                self._stale.append(Path(self._shared[1]))
+            self._shared = (points, path)
+            self._remove_stale()
+            return path
+
+    def _remove_stale(self):
+        """删除旧的点云文件，仍被工作进程映射而无法删除的留到下次共享或关闭时"""
+        remaining = []
+        for path in self._stale:
+            try:
+                path.unlink(missing_ok=True)
+            except PermissionError:
+                remaining.append(path)
+        self._stale = remaining
+
+    def map_tiles(self, func, points, grid_x, grid_y, tile_size: int, **kwargs):
+        """
+        在工作进程中对每个瓦片调用 func(points, grid_x, grid_y, tree=..., **kwargs)
+        grid_x, grid_y 为规则网格的 meshgrid；func 返回一个或多个与瓦片同形的数组，
+        按瓦片位置拼接后返回
+        """
+        path = self.share(points)
+        x, y = grid_x[0], grid_y[:, 0]
+        tiles = [
+            (rows, cols)
+            for rows in _spans(len(y), tile_size)
+            for cols in _spans(len(x), tile_size)
+        ]
+        try:
+            return self._map(func, path, (x, y), tiles, kwargs)
+        except BrokenProcessPool:
+            # 工作进程异常退出（如内存不足被终止）后重建进程池，重试一次
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._map(func, path, (x, y), tiles, kwargs)
+
+    def _map(self, func, path: str, axes: tuple, tiles: list, kwargs: dict):
+        x, y = axes
+        futures = [
+            self._executor.submit(_tile_job, func, path, x[cols], y[rows], kwargs)
+            for rows, cols in tiles
+        ]
+        shape = (len(y), len(x))
+        outputs = None
+        for (rows, cols), future in zip(tiles, futures):
+            result = future.result()
+            single = not isinstance(result, tuple)
+            result = (result,) if single else result
+            if outputs is None:
+                outputs = [np.full(shape, np.nan) for _ in result]
+            for output, value in zip(outputs, result):
+                output[rows, cols] = value
+        if outputs is None:
+            return np.full(shape, np.nan)
+        return outputs[0] if single else tuple(outputs)
+
+    def shutdown(self):
+        # 工作进程退出后才解除对点云文件的映射
+        self._executor.shutdown()
+        self._dir.cleanup()
+
+
+def _spans(length: int, size: int):
+    return [slice(start, min(start + size, length)) for start in range(0, length, size)]
+
+
+_pool: DemWorkerPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(workers: int):
+    """返回进程内共用的工作进程池，进程数按 worker_count 限制，变化时重新创建"""
+    global _pool  # noqa: PLW0603
+    workers = worker_count(workers)
+    with _pool_lock:
+        if _pool is None or _pool.workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = DemWorkerPool(workers)
+        return _pool
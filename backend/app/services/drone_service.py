@@ -1,11 +1,30 @@
 import asyncio
+import logging
+import threading
+import time
+from collections import deque
 from typing import Literal
 
+import numpy as np
 from djitellopy import Tello
 from pydantic import BaseModel
 
 from .record_service import RecordService
 
+# 随录制帧记录的遥测字段：高度 h/tof（cm）、气压高度 baro（m）、
+# 姿态 pitch/roll/yaw（度）与速度 vgx/vgy/vgz（dm/s）
+TELEMETRY_FIELDS = ("h", "tof", "baro", "pitch", "roll", "yaw", "vgx", "vgy", "vgz")
+
+
+class _RcLogFilter(logging.Filter):
+    """djitellopy 以 INFO 级别记录每条指令，过滤控制线程每秒数十次的 rc 心跳"""
+
+    def filter(self, record: logging.LogRecord):
+        return record.levelno > logging.INFO or "'rc " not in record.getMessage()
+
+
+Tello.LOGGER.addFilter(_RcLogFilter())
+
 
 class DroneCommand(BaseModel):
     action: Literal["takeoff", "land", "press", "release"]
@@ -14,9 +33,19 @@ class DroneCommand(BaseModel):
 
 class DroneService:
     SPEED = 60
+    # 控制统计保留的最近样本数
+    STATS_WINDOW = 500
 
-    def __init__(self, record_service: RecordService):
-        self.drone = Tello()
+    def __init__(
+        self,
+        record_service: RecordService,
+        host: str = Tello.TELLO_IP,
+        control_port: int = Tello.CONTROL_UDP_PORT,
+        rc_rate: float = 30.0,
+    ):
+        self.drone = Tello(host)
+        # 指令端口可配置，便于对接本机的模拟 Tello
+        self.drone.address = (host, control_port)
         self.record_service = record_service
         self.for_back_velocity = 0
         self.left_right_velocity = 0
@@ -24,6 +53,100 @@ class DroneService:
         self.yaw_velocity = 0
         self.speed = 10
         self.send_rc_control = False
+        self.record_service.telemetry = self.telemetry
+        # 控制线程按固定频率发送当前速度向量，按键事件只整体替换 _rc_state
+        self.rc_rate = rc_rate
+        self._rc_state = (0, 0, 0, 0, time.perf_counter())
+        self._rc_changed = threading.Event()
+        self._rc_thread: threading.Thread | None = None
+        self._rc_running = False
+        self.rc_sent = 0
+        # 按键事件到指令发出的延迟、定时发送相对周期的抖动（秒）
+        self._rc_latency: deque[float] = deque(maxlen=self.STATS_WINDOW)
+        self._rc_jitter: deque[float] = deque(maxlen=self.STATS_WINDOW)
+
+    def telemetry(self):
+        """最近一次状态包中的遥测数据，不发起网络请求"""
+        state = self.drone.get_current_state()
+        return {key: state[key] for key in TELEMETRY_FIELDS if key in state}
+
+    def start_control(self):
+        if self._rc_thread is not None and self._rc_thread.is_alive():
+            return
+        self._rc_running = True
+        self._rc_thread = threading.Thread(target=self._control_loop, daemon=True)
+        self._rc_thread.start()
+
+    def stop_control(self):
+        self._rc_running = False
+        self._rc_changed.set()
+        if self._rc_thread is not None:
+            self._rc_thread.join()
+            self._rc_thread = None
+
+    def _send_rc(self, state: tuple[int, int, int, int, float]):
+        """直接发送 rc 指令，发送频率由控制线程保证"""
+        lr, fb, ud, yaw = (max(-100, min(100, v)) for v in state[:4])
+        self.drone.send_command_without_return(f"rc {lr} {fb} {ud} {yaw}")
+        self.rc_sent += 1
+
+    def _control_loop(self):
+        """
+        控制线程：按 rc_rate 定时发送当前速度向量作为心跳；
+        速度变化时立即发送并从此刻重新计时，按键到发送的延迟不受周期限制
+        """
+        period = 1 / self.rc_rate
+        # 启动前的状态不是按键事件，不计入延迟
+        sent_state = self._rc_state
+        next_tick = time.perf_counter()
+        while self._rc_running:
+            changed = self._rc_changed.wait(max(next_tick - time.perf_counter(), 0))
+            self._rc_changed.clear()
+            if not self._rc_running:
+                break
+            now = time.perf_counter()
+            state = self._rc_state
+            if not changed:
+                self._rc_jitter.append(abs(now - next_tick))
+            if self.send_rc_control:
+                self._send_rc(state)
+                sent = time.perf_counter()
+                if state is not sent_state:
+                    self._rc_latency.append(sent - state[4])
+                sent_state = state
+            next_tick = now + period
+
+    def control_stats(self):
+        """控制线程的发送次数、按键到发送的延迟与定时抖动（毫秒）"""
+
+        def summary(samples: deque[float]):
+            if not samples:
+                return None
+            values = np.array(samples) * 1000
+            return {
+                "mean": round(float(values.mean()), 3),
+                "p95": round(float(np.percentile(values, 95)), 3),
+                "max": round(float(values.max()), 3),
+            }
+
+        return {
+            "rate": self.rc_rate,
+            "running": self._rc_thread is not None and self._rc_thread.is_alive(),
+            "sent": self.rc_sent,
+            "latency_ms": summary(self._rc_latency),
+            "jitter_ms": summary(self._rc_jitter),
+        }
+
+    def _publish(self):
+        """整体替换速度状态并唤醒控制线程"""
+        self._rc_state = (
+            self.left_right_velocity,
+            self.for_back_velocity,
+            self.up_down_velocity,
+            self.yaw_velocity,
+            time.perf_counter(),
+        )
+        self._rc_changed.set()
 
     async def connect(self):
         loop = asyncio.get_event_loop()
@@ -32,22 +155,16 @@ class DroneService:
             await loop.run_in_executor(None, self.drone.set_speed, self.speed)
             await loop.run_in_executor(None, self.drone.streamon)
             self.record_service.start_recording()
+            self.start_control()
         except Exception as e:
             raise Exception(f"Failed to connect to drone: {str(e)}")
 
     async def disconnect(self):
+        self.send_rc_control = False
         await asyncio.get_event_loop().run_in_executor(None, self.drone.land)
+        await asyncio.to_thread(self.stop_control)
         self.record_service.stop_recording()
 
-    def _update(self):
-        if self.send_rc_control:
-            self.drone.send_rc_control(
-                self.left_right_velocity,
-                self.for_back_velocity,
-                self.up_down_velocity,
-                self.yaw_velocity,
-            )
-
     def _handle_press(self, key: str):
         match key:
             case "w":
@@ -85,13 +202,14 @@ class DroneService:
                 await loop.run_in_executor(None, self.drone.takeoff)
                 self.send_rc_control = True
             elif command.action == "land":
-                await loop.run_in_executor(None, self.drone.land)
+                # 先停止发送 rc 指令，避免与降落指令交错
                 self.send_rc_control = False
+                await loop.run_in_executor(None, self.drone.land)
             elif command.action == "press":
                 self._handle_press(command.key)  # type: ignore
-                loop.run_in_executor(None, self._update)
+                self._publish()
             elif command.action == "release":
                 self._handle_release(command.key)  # type: ignore
-                loop.run_in_executor(None, self._update)
+                self._publish()
         except Exception as e:
             raise Exception(f"Failed to execute command: {str(e)}")
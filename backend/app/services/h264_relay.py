@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from fractions import Fraction
+from pathlib import Path
+
+import av
+import numpy as np
+
+# 录制文件的时间基（微秒），时间戳取自包到达时刻，保留真实帧率
+TIME_BASE = Fraction(1, 1_000_000)
+
+# 订阅回调：(H.264 访问单元, 是否关键帧, 到达时间戳)
+PacketCallback = Callable[[bytes, bool, float], None]
+
+logger = logging.getLogger(__name__)
+
+
+class H264Relay:
+    """
+    直接读取无人机 UDP 视频端口的 H.264 码流，不做解码/重编码：
+    按包封装进录制文件、转发给能解码 H.264 的订阅者，
+    仅在 decode 为真时解码画面，frame 属性与 djitellopy 的 BackgroundFrameRead 一致
+    """
+
+    def __init__(
+        self,
+        address: str = "udp://@0.0.0.0:11111",
+        timeout: float = 10.0,
+        read_timeout: float = 2.0,
+    ):
+        self.address = address
+        # 打开码流与等待数据包的超时（秒）；读取超时后重新打开，stop() 最多等待这么久
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self.frame: np.ndarray | None = None
+        self.decode = False
+        self.subscribers: list[PacketCallback] = []
+        self.packets = 0
+        self.error: Exception | None = None
+        self._decoding = False
+        self._lock = threading.Lock()
+        self._output: av.container.OutputContainer | None = None
+        self._output_stream: av.VideoStream | None = None
+        self._record_dir: Path | None = None
+        self._segment_duration = 0.0
+        self._on_frame: Callable[[int, Path], None] | None = None
+        self._segment = -1
+        self._segment_path: Path | None = None
+        self._segment_start = 0.0
+        self._last_pts = -1
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stopped = False
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            # 读取线程在 read_timeout 内检查 _stopped；正在打开码流时最多等待 timeout
+            self._thread.join(self.timeout + self.read_timeout)
+            if self._thread.is_alive():
+                logger.warning("H.264 relay thread did not stop in time")
+            self._thread = None
+        self.stop_recording()
+
+    def start_recording(
+        self,
+        record_dir: Path,
+        segment_duration: float,
+        on_frame: Callable[[int, Path], None] | None = None,
+    ):
+        """
+        把码流原样分段封装进 record_dir/segment_XXXXX.mkv（Matroska）
+        分段从关键帧开始，超过 segment_duration 秒后在下一个关键帧处切换；
+        每封装一帧调用 on_frame(分段号, 分段路径)
+        """
+        with self._lock:
+            if self._record_dir is not None:
+                raise RuntimeError("Recording is already in progress.")
+            self._record_dir = record_dir
+            self._segment_duration = segment_duration
+            self._on_frame = on_frame
+            self._segment = -1
+        self.start()
+
+    def _close_segment(self):
+        if self._output is not None:
+            self._output.close()
+        self._output = None
+        self._output_stream = None
+        self._last_pts = -1
+
+    def stop_recording(self):
+        with self._lock:
+            self._close_segment()
+            self._record_dir = None
+            self._on_frame = None
+
+    def _mux(
+        self, stream: av.VideoStream, data: bytes, keyframe: bool, timestamp: float
+    ):
+        # 每个分段必须从关键帧开始才能独立解码
+        if keyframe and (
+            self._output is None
+            or timestamp - self._segment_start >= self._segment_duration
+        ):
+            self._close_segment()
+            self._segment += 1
+            self._segment_path = self._record_dir / f"segment_{self._segment:05d}.mkv"  # type: ignore[operator]
+            self._output = av.open(str(self._segment_path), "w", format="matroska")
+            self._output_stream = self._output.add_stream_from_template(stream)
+            self._segment_start = timestamp
+        if self._output is None:
+            return
+        pts = round((timestamp - self._segment_start) / TIME_BASE)
+        pts = max(pts, self._last_pts + 1)
+        self._last_pts = pts
+        packet = av.Packet(data)
+        packet.stream = self._output_stream  # type: ignore[assignment]
+        packet.time_base = TIME_BASE
+        packet.pts = packet.dts = pts
+        packet.is_keyframe = keyframe
+        self._output.mux(packet)
+        if self._on_frame is not None:
+            self._on_frame(self._segment, self._segment_path)
+
+    def _decode(self, stream: av.VideoStream, packet: av.Packet, keyframe: bool):
+        """开启解码后从关键帧开始解码，避免缺少参考帧的花屏"""
+        if not self.decode:
+            self._decoding = False
+            return
+        if not self._decoding:
+            if not keyframe:
+                return
+            self._decoding = True
+        try:
+            for frame in stream.codec_context.decode(packet):
+                self.frame = frame.to_ndarray(format="rgb24")
+        except av.FFmpegError as e:
+            logger.debug("H.264 decode error, waiting for next keyframe: %r", e)
+            self._decoding = False
+
+    def _run(self):
+        """读取码流直到 stop()；无人机暂停发送超过 read_timeout 时重新打开码流"""
+        while not self._stopped:
+            try:
+                container = av.open(
+                    self.address,
+                    format="h264",
+                    options={
+                        "probesize": "32768",
+                        "analyzeduration": "0",
+                        "fflags": "nobuffer",
+                    },
+                    timeout=(self.timeout, self.read_timeout),
+                )
+            except av.FFmpegError as e:
+                logger.warning("Failed to open H.264 stream %s: %r", self.address, e)
+                self.error = e
+                return
+            try:
+                self._demux(container)
+            except av.FFmpegError as e:
+                if not self._stopped:
+                    logger.info("H.264 stream interrupted, reopening: %r", e)
+                self.error = e
+            finally:
+                container.close()
+            # 新连接的码流从关键帧开始解码与分段
+            self._decoding = False
+            with self._lock:
+                self._close_segment()
+
+    def _demux(self, container: av.container.InputContainer):
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            if self._stopped:
+                return
+            if packet.size == 0:
+                continue
+            timestamp = time.monotonic()
+            data = bytes(packet)
+            keyframe = packet.is_keyframe
+            self.packets += 1
+            for callback in list(self.subscribers):
+                callback(data, keyframe, timestamp)
+            self._decode(stream, packet, keyframe)
+            with self._lock:
+                if self._record_dir is not None:
+                    self._mux(stream, data, keyframe, timestamp)
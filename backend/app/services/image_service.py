@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Literal, NamedTuple
+
+import cv2
+
+ImageSize = Literal["thumb", "preview", "full"]
+# 缩略图与预览图的长边像素数，full 为原图
+THUMBNAIL_SIZES = {"thumb": 160, "preview": 640}
+THUMBNAIL_QUALITY = 85
+
+
+class ImageEntry(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+
+    @property
+    def version(self):
+        """文件大小与修改时间组成的版本号，用于缩略图缓存键与 ETag"""
+        return f"{self.mtime_ns:x}-{self.size:x}"
+
+
+class ImageService:
+    """
+    图片目录的内存索引与缩略图缓存
+    索引以目录的修改时间为版本，目录中增删文件后才重新扫描；
+    重新扫描后在后台线程中为每张图片生成各尺寸的缩略图
+    """
+
+    def __init__(self, cache_dir: Path, workers: int = 2, max_bytes: int = 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        for name in THUMBNAIL_SIZES:
+            (cache_dir / name).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # 图片目录 -> (目录修改时间, 按文件名排序的图片)
+        self._indexes: dict[Path, tuple[int, list[ImageEntry]]] = {}
+        # 正在生成缩略图的图片，避免后台预生成与请求重复生成
+        self._pending: dict[tuple[Path, str], Future] = {}
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="thumbnail")
+
+    def images(self, image_dir: Path) -> list[ImageEntry]:
+        try:
+            stamp = image_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            cached = self._indexes.get(image_dir)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        # 先取目录版本再扫描，扫描期间的变化会在下次请求时重新扫描
+        with os.scandir(image_dir) as it:
+            entries = sorted(
+                (
+                    ImageEntry(Path(e.path), (st := e.stat()).st_size, st.st_mtime_ns)
+                    for e in it
+                    if e.is_file()
+                ),
+                key=lambda entry: entry.path,
+            )
+        with self._lock:
+            self._indexes[image_dir] = (stamp, entries)
+        self._prefetch(entries)
+        return entries
+
+    def _thumbnail_path(self, entry: ImageEntry, size: str):
+        key = hashlib.blake2b(
+            f"{entry.path}:{entry.version}".encode(), digest_size=16
+        ).hexdigest()
+        return self.cache_dir / size / f"{key}.jpg"
+
+    def _render(self, entry: ImageEntry):
+        """解码一次原图，生成所有尺寸的缩略图"""
+        image = cv2.imread(str(entry.path), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Failed to read image: {entry.path}")
+        for size, long_side in THUMBNAIL_SIZES.items():
+            path = self._thumbnail_path(entry, size)
+            if path.exists():
+                continue
+            scale = min(1.0, long_side / max(image.shape[:2]))
+            resized = cv2.resize(
+                image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+            ok, data = cv2.imencode(
+                ".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY]
+            )
+            if not ok:
+                raise ValueError(f"Failed to encode thumbnail: {entry.path}")
+            tmp_path = path.with_name(path.name + ".tmp")
+            tmp_path.write_bytes(data.tobytes())
+            os.replace(tmp_path, path)
+
+    def _submit(self, entry: ImageEntry):
+        key = (entry.path, entry.version)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pool.submit(self._render, entry)
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._pending.pop(key, None))
+        return future
+
+    def _prefetch(self, entries: list[ImageEntry]):
+        missing = [
+            e for e in entries if not self._thumbnail_path(e, "preview").exists()
+        ]
+        for entry in missing:
+            self._submit(entry)
+        if missing:
+            self._pool.submit(self._evict)
+
+    def thumbnail(self, entry: ImageEntry, size: ImageSize) -> Path:
+        """返回指定尺寸的图片路径，缩略图尚未生成时等待生成完成"""
+        if size == "full":
+            return entry.path
+        path = self._thumbnail_path(entry, size)
+        if not path.exists():
+            self._submit(entry).result()
+        os.utime(path)
+        return path
+
+    def _evict(self):
+        """按最近使用时间淘汰缩略图，使总字节数不超过 max_bytes"""
+        entries = sorted(
+            (p.stat().st_mtime_ns, p.stat().st_size, p)
+            for p in self.cache_dir.glob("*/*.jpg")
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
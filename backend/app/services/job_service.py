@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel
+
+from .cpu import set_job_slots
+from .dem import DemService
+
+JobState = Literal["pending", "running", "succeeded", "failed", "cancelled"]
+
+# 处理阶段及其开始时的进度
+STAGES = {
+    "ingest": 0.0,
+    "reconstruction": 0.1,
+    "interpolation": 0.5,
+    "color": 0.8,
+    "export": 0.9,
+}
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class JobInfo(BaseModel):
+    id: str
+    state: JobState
+    stage: str | None = None
+    progress: float = 0.0
+    message: str | None = None
+
+
+class JobProgress:
+    """
+    工作进程内的阶段进度回调
+    通过作业目录中的 stage / cancel 文件与主进程通信，取消时抛出 JobCancelledError
+    """
+
+    def __init__(self, work_dir: Path):
+        self.work_dir = work_dir
+
+    def __call__(self, stage: str):
+        if (self.work_dir / "cancel").exists():
+            raise JobCancelledError()
+        tmp_path = self.work_dir / "stage.tmp"
+        tmp_path.write_text(stage)
+        os.replace(tmp_path, self.work_dir / "stage")
+
+
+def _run_job(fn: Callable, work_dir: Path, args: tuple):
+    fn(*args, work_dir=work_dir, progress=JobProgress(work_dir))
+
+
+class JobService:
+    """
+    DEM 处理作业管理：有界进程池、阶段进度、协作式取消与按作业保存结果
+    作业函数签名为 fn(*args, work_dir: Path, progress: JobProgress)，
+    结果写入 work_dir/result.npz
+    """
+
+    def __init__(
+        self,
+        jobs_dir: Path | None = None,
+        max_workers: int = 2,
+        max_jobs: int = 16,
+        max_loaded_results: int = 4,
+    ):
+        self.jobs_dir = jobs_dir or Path(tempfile.gettempdir()) / "dem" / "jobs"
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_loaded_results = max_loaded_results
+        # 进程池在首次提交时创建，避免工作进程导入本模块时再次创建
+        self._executor: ProcessPoolExecutor | None = None
+        self._jobs: OrderedDict[str, Future] = OrderedDict()
+        self._results: OrderedDict[str, DemService] = OrderedDict()
+        self.latest_job_id: str | None = None
+
+    def _create_executor(self):
+        # 作业进程内的特征与插值进程池按同时运行的作业数平分 CPU
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=set_job_slots,
+            initargs=(self.max_workers,),
+        )
+
+    def work_dir(self, job_id: str):
+        return self.jobs_dir / job_id
+
+    def submit(self, fn: Callable, *args) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        work_dir = self.work_dir(job_id)
+        work_dir.mkdir(parents=True)
+        if self._executor is None:
+            self._executor = self._create_executor()
+        try:
+            future = self._executor.submit(_run_job, fn, work_dir, args)
+        except BrokenProcessPool:
+            self._executor = self._create_executor()
+            future = self._executor.submit(_run_job, fn, work_dir, args)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        self._jobs[job_id] = future
+        self._prune()
+        return job_id
+
+    def _on_done(self, job_id: str, future: Future):
+        if not future.cancelled() and future.exception() is None:
+            self.latest_job_id = job_id
+
+    def _prune(self):
+        """删除超出 max_jobs 的最早的已结束作业及其目录"""
+        for job_id in list(self._jobs)[: -self.max_jobs]:
+            if not self._jobs[job_id].done() or job_id == self.latest_job_id:
+                continue
+            del self._jobs[job_id]
+            self._results.pop(job_id, None)
+            shutil.rmtree(self.work_dir(job_id), ignore_errors=True)
+
+    def status(self, job_id: str) -> JobInfo | None:
+        future = self._jobs.get(job_id)
+        if future is None:
+            return None
+        stage_path = self.work_dir(job_id) / "stage"
+        stage = stage_path.read_text() if stage_path.exists() else None
+        info = JobInfo(id=job_id, state="pending", stage=stage)
+        if future.cancelled():
+            info.state = "cancelled"
+        elif not future.done():
+            if future.running() and stage is not None:
+                info.state = "running"
+                info.progress = STAGES.get(stage, 0.0)
+        elif isinstance(future.exception(), JobCancelledError):
+            info.state = "cancelled"
+        elif future.exception() is not None:
+            info.state = "failed"
+            info.message = str(future.exception())
+        else:
+            info.state = "succeeded"
+            info.progress = 1.0
+        return info
+
+    def list(self) -> list[JobInfo]:
+        return [self.status(job_id) for job_id in self._jobs]  # type: ignore[misc]
+
+    def cancel(self, job_id: str) -> bool:
+        future = self._jobs.get(job_id)
+        if future is None:
+            return False
+        if not future.cancel() and not future.done():
+            # 已在运行，通知工作进程在下一个阶段检查点退出
+            (self.work_dir(job_id) / "cancel").touch()
+        return True
+
+    def shutdown(self):
+        """
+        取消排队中的作业并通知运行中的作业退出，等待工作进程在下一个阶段检查点结束
+        """
+        for job_id, future in self._jobs.items():
+            if not future.done():
+                self.cancel(job_id)
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def get_dem_service(self, job_id: str) -> DemService | None:
+        """读取作业的 DEM 结果，最近使用的若干个保留在内存中"""
+        if job_id in self._results:
+            self._results.move_to_end(job_id)
+            return self._results[job_id]
+        result_path = self.work_dir(job_id) / "result.npz"
+        if job_id not in self._jobs or not result_path.exists():
+            return None
+        dem_service = DemService()
+        dem_service.load_result(result_path)
+        self._results[job_id] = dem_service
+        while len(self._results) > self.max_loaded_results:
+            self._results.popitem(last=False)
+        return dem_service
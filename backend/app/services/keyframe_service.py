@@ -0,0 +1,260 @@
+import logging
+import math
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from pydantic import BaseModel
+
+from .record_service import read_recording_index
+
+logger = logging.getLogger(__name__)
+
+# 计算清晰度与位移时使用的缩略图宽度
+THUMBNAIL_WIDTH = 320
+
+
+class KeyframeConfig(BaseModel):
+    # 每个时间窗口（秒）最多保留一帧，取窗口内最清晰的候选帧
+    interval: float = 1.0
+    # 每个窗口内解码并评分的候选帧数
+    candidates: int = 4
+    # 拉普拉斯方差低于该值的帧视为模糊帧
+    min_sharpness: float = 10.0
+    # 相对上一关键帧的位移（占画面宽度的比例）低于该值视为冗余帧
+    min_motion: float = 0.02
+    # 位移超过该值时立即提交当前最佳帧，保证相邻关键帧有足够重叠
+    max_motion: float = 0.3
+    # 编码写入图片的线程数
+    workers: int = 4
+
+
+class KeyframeSelector:
+    """
+    按清晰度与相对上一关键帧的位移挑选关键帧
+    依次 offer 候选帧，返回已确定的关键帧 [(key, frame)]，结束时调用 flush
+    """
+
+    def __init__(self, config: KeyframeConfig):
+        self.config = config
+        self._window: int | None = None
+        self._best: tuple[object, np.ndarray, float, np.ndarray] | None = None
+        self._last: np.ndarray | None = None
+
+    @staticmethod
+    def _thumbnail(frame: np.ndarray):
+        gray = frame
+        if frame.ndim == 3:  # noqa: PLR2004
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = THUMBNAIL_WIDTH / gray.shape[1]
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray.astype(np.float32)
+
+    def _motion(self, thumbnail: np.ndarray):
+        """相对上一关键帧的平移量（占画面宽度的比例），相关性过低时视为大位移"""
+        if self._last is None:
+            return None
+        (dx, dy), response = cv2.phaseCorrelate(self._last, thumbnail)
+        if response < 0.1:  # noqa: PLR2004
+            return math.inf
+        return math.hypot(dx, dy) / thumbnail.shape[1]
+
+    def _commit(self):
+        if self._best is None:
+            return []
+        key, frame, _, thumbnail = self._best
+        self._best = None
+        self._last = thumbnail
+        return [(key, frame)]
+
+    def offer(self, key, frame: np.ndarray, timestamp: float):
+        ready = []
+        window = int(timestamp // self.config.interval)
+        if window != self._window:
+            ready += self._commit()
+            self._window = window
+
+        thumbnail = self._thumbnail(frame)
+        sharpness = cv2.Laplacian(thumbnail, cv2.CV_32F).var()
+        if sharpness < self.config.min_sharpness:
+            return ready
+        motion = self._motion(thumbnail)
+        if motion is not None and motion < self.config.min_motion:
+            return ready
+
+        if self._best is None or sharpness > self._best[2]:
+            self._best = (key, frame, sharpness, thumbnail)
+        if motion is not None and motion > self.config.max_motion:
+            ready += self._commit()
+        return ready
+
+    def flush(self):
+        return self._commit()
+
+
+class LiveKeyframeIngest:
+    """
+    飞行中实时抽取关键帧：采集线程按候选时段 offer 帧（不阻塞），
+    后台线程评分挑选并写入 image_dir，count 为已写入的关键帧数
+    """
+
+    QUEUE_SIZE = 4
+
+    def __init__(self, image_dir: Path, config: KeyframeConfig):
+        self.image_dir = image_dir
+        self.config = config
+        self.count = 0
+        self.dropped_frames = 0
+        # 先写入临时目录再移动，读取方不会看到写了一半的图片
+        self._tmp_dir = image_dir.parent / "tmp"
+        for path in (image_dir, self._tmp_dir):
+            shutil.rmtree(path, ignore_errors=True)
+            path.mkdir(parents=True)
+        self._selector = KeyframeSelector(config)
+        self._slot: int | None = None
+        self._queue: queue.Queue[tuple[np.ndarray, float] | None] = queue.Queue(
+            maxsize=self.QUEUE_SIZE
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def offer(self, frame: np.ndarray, timestamp: float):
+        """每个候选时段只取第一帧，评分线程落后时丢弃"""
+        slot = int(timestamp // (self.config.interval / self.config.candidates))
+        if slot == self._slot:
+            return
+        self._slot = slot
+        try:
+            self._queue.put_nowait((frame, timestamp))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def _write(self, frame_index: int, frame: np.ndarray):
+        """写入失败时记录日志并继续，避免评分线程退出后 stop() 阻塞在满队列上"""
+        name = f"frame_{frame_index:08d}.jpg"
+        try:
+            if not cv2.imwrite(str(self._tmp_dir / name), frame):
+                raise OSError(f"Failed to encode keyframe {name}")
+            os.replace(self._tmp_dir / name, self.image_dir / name)
+        except (OSError, cv2.error):
+            logger.exception("Failed to write live keyframe %s", name)
+            return
+        self.count += 1
+
+    def _run(self):
+        frame_index = 0
+        while (item := self._queue.get()) is not None:
+            frame, timestamp = item
+            for key, keyframe in self._selector.offer(frame_index, frame, timestamp):
+                self._write(key, keyframe)
+            frame_index += 1
+        for key, keyframe in self._selector.flush():
+            self._write(key, keyframe)
+
+    def stop(self):
+        """处理完队列中的帧并写入最后一个关键帧"""
+        self._queue.put(None)
+        self._thread.join()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+def extract_keyframes(video_path: str, image_dir: Path, config: KeyframeConfig):
+    """
+    从视频中抽取关键帧写入 image_dir，返回写入的帧数
+    非候选帧只 grab 不解码，候选帧 retrieve 后评分，关键帧在线程池中编码写入
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, round(fps * config.interval / config.candidates))
+    selector = KeyframeSelector(config)
+
+    def write(frame_index: int, frame: np.ndarray):
+        cv2.imwrite(str(image_dir / f"frame_{frame_index:08d}.jpg"), frame)
+
+    with ThreadPoolExecutor(max_workers=config.workers) as pool:
+        futures = []
+        frame_index = 0
+        while cap.grab():
+            if frame_index % step == 0:
+                ret, frame = cap.retrieve()
+                if ret:
+                    for key, keyframe in selector.offer(
+                        frame_index, frame, frame_index / fps
+                    ):
+                        futures.append(pool.submit(write, key, keyframe))
+            frame_index += 1
+        for key, keyframe in selector.flush():
+            futures.append(pool.submit(write, key, keyframe))
+        for future in futures:
+            future.result()
+
+    cap.release()
+    return len(futures)
+
+
+def _extract_segment(
+    video_path: Path,
+    frames: list[dict],
+    config: KeyframeConfig,
+    write,
+):
+    """按索引中的采集时间戳从单个分段中挑选关键帧，每个候选时段只解码一帧"""
+    cap = cv2.VideoCapture(str(video_path))
+    selector = KeyframeSelector(config)
+    slot_length = config.interval / config.candidates
+    last_slot = None
+    written = 0
+    for record in frames:
+        if not cap.grab():
+            break
+        slot = int(record["timestamp"] // slot_length)
+        if slot == last_slot:
+            continue
+        last_slot = slot
+        ret, frame = cap.retrieve()
+        if ret:
+            for key, keyframe in selector.offer(
+                record["index"], frame, record["timestamp"]
+            ):
+                write(key, keyframe)
+                written += 1
+    for key, keyframe in selector.flush():
+        write(key, keyframe)
+        written += 1
+    cap.release()
+    return written
+
+
+def extract_recording_keyframes(
+    record_dir: Path, image_dir: Path, config: KeyframeConfig
+):
+    """
+    从分段录制中抽取关键帧写入 image_dir，返回写入的帧数
+    只处理已写完的分段（录制进行中也可调用），各分段在线程池中并行处理，
+    候选帧按索引中的真实采集时间戳选取
+    """
+    frames, segments = read_recording_index(record_dir)
+    by_segment: dict[int, list[dict]] = {}
+    for record in frames:
+        by_segment.setdefault(record["segment"], []).append(record)
+
+    def write(frame_index: int, frame: np.ndarray):
+        cv2.imwrite(str(image_dir / f"frame_{frame_index:08d}.jpg"), frame)
+
+    with ThreadPoolExecutor(max_workers=config.workers) as pool:
+        futures = [
+            pool.submit(
+                _extract_segment,
+                record_dir / segment["path"],
+                by_segment.get(segment["segment"], []),
+                config,
+                write,
+            )
+            for segment in segments
+        ]
+        return sum(future.result() for future in futures)
@@ -1,3 +1,11 @@
+from .features import FeatureConfig
+from .octree import PointCloudLod, load_pointcloud_lod, source_stamp
 from .ply_service import PlyService
 
-__all__ = ["PlyService"]
\ No newline at end of file
+__all__ = [
+    "FeatureConfig",
+    "PlyService",
+    "PointCloudLod",
+    "load_pointcloud_lod",
+    "source_stamp",
+]
@@ -0,0 +1,162 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Literal
+
+import cv2
+import numpy as np
+from pydantic import BaseModel
+
+from ..cache import DiskCache
+
+
+class FeatureConfig(BaseModel):
+    # 特征检测器
+    detector: Literal["sift", "orb"] = "sift"
+    # 每张图片最多保留的特征点数
+    max_features: int = 4000
+    # 检测前把图片长边缩放到不超过该值，特征点坐标换算回原图
+    max_image_size: int = 1600
+    # 每张图片与其后 window 张图片组成候选匹配对
+    window: int = 5
+    # Lowe 比值检验阈值
+    ratio: float = 0.75
+    # 基础矩阵 RANSAC 的重投影阈值（像素）
+    ransac_threshold: float = 2.0
+    # 几何校验后少于该值的匹配对视为无效
+    min_matches: int = 30
+    # 检测与匹配的进程数，不超过 CPU 数除以同时运行的作业数
+    workers: int = os.cpu_count() or 1
+
+
+# 只影响特征检测 / 只影响匹配结果的配置字段，其余字段不参与对应缓存的键
+DETECT_FIELDS = {"detector", "max_features", "max_image_size"}
+MATCH_FIELDS = DETECT_FIELDS | {"ratio", "ransac_threshold", "min_matches"}
+
+
+def image_hash(path: Path) -> str:
+    """图片内容哈希，重命名或修改时间变化不影响缓存"""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sequence_pairs(count: int, window: int):
+    """按图片顺序在滑动窗口内生成候选匹配对 (i, j)，i < j"""
+    return [
+        (i, j) for i in range(count) for j in range(i + 1, min(i + window + 1, count))
+    ]
+
+
+class FeatureCache:
+    """
+    以图片内容哈希为键的特征点/描述子缓存，以及以两张图片哈希为键的匹配缓存
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 2 * 1024**3):
+        fields = set(FeatureConfig.model_fields)
+        self.features = DiskCache(
+            cache_dir / "features", max_bytes, fields - DETECT_FIELDS
+        )
+        self.matches = DiskCache(
+            cache_dir / "matches", max_bytes, fields - MATCH_FIELDS
+        )
+
+    def feature_key(self, digest: str, config: FeatureConfig):
+        return self.features.key(digest, config)
+
+    def match_key(self, digest_a: str, digest_b: str, config: FeatureConfig):
+        return self.matches.key(f"{digest_a}:{digest_b}", config)
+
+
+def _create_detector(config: FeatureConfig):
+    if config.detector == "orb":
+        return cv2.ORB_create(nfeatures=config.max_features)  # type: ignore[attr-defined]
+    return cv2.SIFT_create(nfeatures=config.max_features)  # type: ignore[attr-defined]
+
+
+def detect_features(path: Path, config: FeatureConfig):
+    """
+    检测单张图片的特征，返回 (keypoints, descriptors)
+    keypoints 为 (N, 4) float32：原图坐标 x、y，尺度 size 与方向 angle
+    """
+    image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Failed to read image: {path}")
+    scale = min(1.0, config.max_image_size / max(image.shape))
+    if scale < 1:
+        image = cv2.resize(
+            image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+    keypoints, descriptors = _create_detector(config).detectAndCompute(image, None)
+    if descriptors is None:
+        return np.empty((0, 4), np.float32), np.empty((0, 0), np.float32)
+    kp = np.array(
+        [
+            (k.pt[0] / scale, k.pt[1] / scale, k.size / scale, k.angle)
+            for k in keypoints
+        ],
+        dtype=np.float32,
+    )
+    return kp, descriptors
+
+
+def match_features(
+    features_a: tuple[np.ndarray, np.ndarray],
+    features_b: tuple[np.ndarray, np.ndarray],
+    config: FeatureConfig,
+):
+    """
+    比值检验 + 基础矩阵 RANSAC 几何校验，返回 (M, 2) int32 的特征点下标对
+    内点少于 min_matches 时返回空数组
+    """
+    empty = np.empty((0, 2), np.int32)
+    (kp_a, desc_a), (kp_b, desc_b) = features_a, features_b
+    if len(kp_a) < 2 or len(kp_b) < 2:  # noqa: PLR2004
+        return empty
+    if config.detector == "orb":
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    else:
+        # SIFT 描述子用 KD 树近似最近邻，比暴力匹配快数倍
+        matcher = cv2.FlannBasedMatcher({"algorithm": 1, "trees": 4}, {"checks": 64})
+    knn = matcher.knnMatch(desc_a, desc_b, k=2)
+    matches = np.array(
+        [
+            (m[0].queryIdx, m[0].trainIdx)
+            for m in knn
+            if len(m) == 2 and m[0].distance < config.ratio * m[1].distance  # noqa: PLR2004
+        ],
+        dtype=np.int32,
+    ).reshape(-1, 2)
+    if len(matches) < max(config.min_matches, 8):
+        return empty
+    _, mask = cv2.findFundamentalMat(
+        kp_a[matches[:, 0], :2],
+        kp_b[matches[:, 1], :2],
+        cv2.FM_RANSAC,
+        config.ransac_threshold,
+        0.999,
+    )
+    if mask is None:
+        return empty
+    inliers = matches[mask.ravel().astype(bool)]
+    return inliers if len(inliers) >= config.min_matches else empty
+
+
+def save_features(path: Path, keypoints: np.ndarray, descriptors: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, keypoints=keypoints, descriptors=descriptors)
+    os.replace(tmp_path, path)
+
+
+def load_features(path: Path):
+    with np.load(path) as data:
+        return data["keypoints"], data["descriptors"]
+
+
+def _match_job(path_a: Path, path_b: Path, config: FeatureConfig):
+    """工作进程：读取两张图片的特征文件进行匹配，只传回匹配结果"""
+    return match_features(load_features(path_a), load_features(path_b), config)
@@ -0,0 +1,211 @@
+import json
+import shutil
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import open3d as o3d
+
+from ..dem.transport import Compression, compress
+
+LOD_DIR = "pointcloud_lod"
+HIERARCHY_FILE = "hierarchy.json"
+# 每个节点最多保留的点数，超出的点下放到子节点
+NODE_POINTS = 65536
+# 节点抽稀网格在每条边上的格数，决定节点的点间距
+NODE_GRID = 128
+MAX_DEPTH = 12
+# int16 量化的取值范围
+QUANT_LEVELS = 65535
+
+
+def source_stamp(path: Path) -> str:
+    """由点云文件大小与修改时间生成的版本号，用于判断 LOD 是否过期和 ETag"""
+    stat = path.stat()
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def _octant(points: np.ndarray, origin: np.ndarray, size: float):
+    """子节点编号：x、y、z 是否位于后半部分分别对应第 2、1、0 位"""
+    upper = points - origin >= size / 2
+    return upper[:, 0] * 4 + upper[:, 1] * 2 + upper[:, 2]
+
+
+def _subsample(points: np.ndarray, origin: np.ndarray, size: float, rng):
+    """在节点的 NODE_GRID^3 网格中每格随机取一个点，返回打乱顺序的被选中下标"""
+    cells = np.floor((points - origin) / size * NODE_GRID).astype(np.int64)
+    np.clip(cells, 0, NODE_GRID - 1, out=cells)
+    cell_id = (cells[:, 0] * NODE_GRID + cells[:, 1]) * NODE_GRID + cells[:, 2]
+    order = rng.permutation(len(points))
+    _, first = np.unique(cell_id[order], return_index=True)
+    # np.unique 按格子编号排序，再打乱使截断后的点在空间上均匀
+    return order[first[rng.permutation(len(first))]]
+
+
+class PointCloudLod:
+    """
+    点云的八叉树细节层次（类似 Potree）：根节点 "r" 覆盖整个点云的包围立方体，
+    子节点编号在父节点编号后追加 0~7。每个节点保存其空间内抽稀后的一部分点，
+    父子节点的点互不重复，加载根节点即可得到粗略预览，逐级加载子节点补充细节
+    节点位置按节点包围盒量化为 int16，颜色为 uint8，
+    保存在 work_dir/pointcloud_lod 下的 nodes/<id>.bin 中
+    """
+
+    def __init__(self, lod_dir: Path, hierarchy: dict):
+        self.lod_dir = lod_dir
+        self.hierarchy = hierarchy
+
+    @property
+    def source(self) -> str:
+        return self.hierarchy["source"]
+
+    @classmethod
+    def build(
+        cls,
+        ply_path: Path,
+        lod_dir: Path,
+        node_points: int = NODE_POINTS,
+        max_depth: int = MAX_DEPTH,
+    ):
+        """读取点云并构建八叉树，先写入临时目录再替换 lod_dir"""
+        source = source_stamp(ply_path)
+        pcd = o3d.io.read_point_cloud(str(ply_path))
+        points = np.asarray(pcd.points)
+        colors = (
+            np.round(np.asarray(pcd.colors) * 255).astype(np.uint8)
+            if pcd.has_colors()
+            else None
+        )
+        if len(points) == 0:
+            raise ValueError(f"Point cloud is empty: {ply_path}")
+
+        low, high = points.min(axis=0), points.max(axis=0)
+        # 包围立方体略微放大，保证最大坐标也落在节点内
+        size = float((high - low).max()) * (1 + 1e-6) or 1.0
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f"{LOD_DIR}.", dir=lod_dir.parent))
+        (tmp_dir / "nodes").mkdir()
+        nodes: dict[str, dict] = {}
+        rng = np.random.default_rng(0)
+        # (节点编号, 深度, 节点内的点下标, 节点原点, 边长)
+        stack = [("r", 0, np.arange(len(points)), low, size)]
+        while stack:
+            node_id, depth, index, origin, node_size = stack.pop()
+            if len(index) <= node_points or depth >= max_depth:
+                selected, rest = index, index[:0]
+            else:
+                chosen = _subsample(points[index], origin, node_size, rng)
+                keep = np.zeros(len(index), dtype=bool)
+                keep[chosen[:node_points]] = True
+                selected, rest = index[keep], index[~keep]
+
+            scale = node_size / QUANT_LEVELS
+            quantized = (
+                np.round((points[selected] - origin) / scale) - (QUANT_LEVELS + 1) // 2
+            )
+            positions = np.clip(quantized, -32768, 32767).astype("<i2")
+            with open(tmp_dir / "nodes" / f"{node_id}.bin", "wb") as f:
+                f.write(positions.tobytes())
+                if colors is not None:
+                    f.write(colors[selected].tobytes())
+
+            children = []
+            if len(rest):
+                octants = _octant(points[rest], origin, node_size)
+                half = node_size / 2
+                for octant in range(8):
+                    child_index = rest[octants == octant]
+                    if not len(child_index):
+                        continue
+                    child_origin = origin + half * np.array(
+                        [(octant >> 2) & 1, (octant >> 1) & 1, octant & 1]
+                    )
+                    child_id = f"{node_id}{octant}"
+                    children.append(child_id)
+                    stack.append((child_id, depth + 1, child_index, child_origin, half))
+            nodes[node_id] = {
+                "count": len(selected),
+                "min": origin.tolist(),
+                "size": node_size,
+                # 坐标按 offset + q * scale 还原
+                "scale": scale,
+                "offset": (origin + scale * ((QUANT_LEVELS + 1) // 2)).tolist(),
+                "children": sorted(children),
+            }
+
+        hierarchy = {
+            "source": source,
+            "points": len(points),
+            "has_colors": colors is not None,
+            "min": low.tolist(),
+            "max": high.tolist(),
+            "depth": max(len(node_id) - 1 for node_id in nodes),
+            "nodes": nodes,
+        }
+        (tmp_dir / HIERARCHY_FILE).write_text(json.dumps(hierarchy))
+        shutil.rmtree(lod_dir, ignore_errors=True)
+        tmp_dir.replace(lod_dir)
+        return cls(lod_dir, hierarchy)
+
+    @classmethod
+    def load(cls, lod_dir: Path):
+        hierarchy = json.loads((lod_dir / HIERARCHY_FILE).read_text())
+        return cls(lod_dir, hierarchy)
+
+    def encode_node(self, node_id: str, compression: Compression = "none"):
+        """
+        编码单个节点：
+        [uint32 头长度][JSON 头][位置 (count, 3) int16][颜色 (count, 3) uint8]
+        """
+        node = self.hierarchy["nodes"].get(node_id)
+        if node is None:
+            raise KeyError(f"Point cloud node {node_id} not found")
+        data = (self.lod_dir / "nodes" / f"{node_id}.bin").read_bytes()
+        position_bytes = node["count"] * 6
+        header = json.dumps(
+            {
+                "id": node_id,
+                "count": node["count"],
+                "scale": node["scale"],
+                "offset": node["offset"],
+                "children": node["children"],
+                "byteorder": "little",
+                "position_bytes": position_bytes,
+                "color_bytes": len(data) - position_bytes,
+            }
+        ).encode()
+        return compress(
+            b"".join((struct.pack("<I", len(header)), header, data)), compression
+        )
+
+
+# 进程内最多保留的已加载 LOD 数，与作业结果一样只保留最近使用的几个
+MAX_LOADED_LODS = 4
+_lods: OrderedDict[Path, PointCloudLod] = OrderedDict()
+_lods_lock = threading.Lock()
+
+
+def load_pointcloud_lod(work_dir: Path):
+    """
+    返回工作目录中 fused.ply 的 LOD，不存在或点云已更新时重新构建
+    最近使用的若干个 LOD 的层次信息保存在进程内，避免每次请求节点都读取 JSON
+    """
+    ply_path = work_dir / "fused.ply"
+    lod_dir = work_dir / LOD_DIR
+    source = source_stamp(ply_path)
+    with _lods_lock:
+        lod = _lods.get(lod_dir)
+        if lod is None or lod.source != source:
+            try:
+                lod = PointCloudLod.load(lod_dir)
+            except (OSError, ValueError):
+                lod = None
+            if lod is None or lod.source != source:
+                lod = PointCloudLod.build(ply_path, lod_dir)
+            _lods[lod_dir] = lod
+        _lods.move_to_end(lod_dir)
+        while len(_lods) > MAX_LOADED_LODS:
+            _lods.popitem(last=False)
+        return lod
@@ -1,6 +1,124 @@
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from ..cpu import worker_count
+from .features import (
+    FeatureCache,
+    FeatureConfig,
+    _match_job,
+    detect_features,
+    image_hash,
+    load_features,
+    save_features,
+    sequence_pairs,
+)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
 class PlyService:
-    def __init__(self, woring_dir):
-        pass
+    """
+    重建前端：对 work_dir/images 中的图片并行检测特征、按顺序窗口选取候选对并行匹配
+    特征与匹配按图片内容哈希缓存，增删少量图片后只重新计算新图片与受影响的匹配对
+    本次运行的特征保存在 work_dir/features 中，缓存只用于在不同运行之间复用，
+    运行期间的缓存淘汰不影响匹配；结果写入 work_dir/matches.npz
+    """
+
+    def __init__(
+        self,
+        work_dir: Path,
+        config: FeatureConfig | None = None,
+        cache_dir: Path | None = None,
+    ):
+        self.work_dir = Path(work_dir)
+        self.config = config or FeatureConfig()
+        self.cache = FeatureCache(
+            cache_dir or Path(tempfile.gettempdir()) / "dem" / "cache"
+        )
+        self.stats: dict[str, int] = {}
+
+    def _images(self):
+        image_dir = self.work_dir / "images"
+        return sorted(
+            p for p in image_dir.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES
+        )
+
+    def _extract(self, pool: ProcessPoolExecutor, images: list[Path]):
+        """
+        返回每张图片的特征缓存键与特征文件，只检测缓存中没有的图片
+        缓存中已有的特征链接到 work_dir/features，新检测的特征写入后再加入缓存
+        """
+        feature_dir = self.work_dir / "features"
+        feature_dir.mkdir(exist_ok=True)
+        keys = [self.cache.feature_key(image_hash(p), self.config) for p in images]
+        paths = [feature_dir / f"{key}.npz" for key in keys]
+        missing = [
+            i
+            for i, key in enumerate(keys)
+            if not self.cache.features.link(key, paths[i])
+        ]
+        futures = [
+            (i, pool.submit(detect_features, images[i], self.config)) for i in missing
+        ]
+        for i, future in futures:
+            save_features(paths[i], *future.result())
+            self.cache.features.add(keys[i], paths[i])
+        self.stats["features_computed"] = len(missing)
+        self.stats["features_cached"] = len(images) - len(missing)
+        return keys, paths
+
+    def _match(
+        self,
+        pool: ProcessPoolExecutor,
+        keys: list[str],
+        paths: list[Path],
+        pairs: list[tuple[int, int]],
+    ):
+        """返回每个候选对的匹配，只匹配缓存中没有的候选对"""
+        results: dict[tuple[int, int], np.ndarray] = {}
+        futures = []
+        for i, j in pairs:
+            key = self.cache.match_key(keys[i], keys[j], self.config)
+            cached = self.cache.matches.get(key)
+            if cached is not None:
+                results[i, j] = cached["matches"]
+            else:
+                future = pool.submit(_match_job, paths[i], paths[j], self.config)
+                futures.append(((i, j), key, future))
+        for pair, key, future in futures:
+            results[pair] = future.result()
+            self.cache.matches.put(key, matches=results[pair])
+        self.stats["matches_computed"] = len(futures)
+        self.stats["matches_cached"] = len(pairs) - len(futures)
+        return results
 
     def __call__(self):
-        pass
\ No newline at end of file
+        images = self._images()
+        pairs = sequence_pairs(len(images), self.config.window)
+        with ProcessPoolExecutor(max_workers=worker_count(self.config.workers)) as pool:
+            keys, paths = self._extract(pool, images)
+            results = self._match(pool, keys, paths, pairs)
+
+        # 拼接为扁平数组：第 k 张图片的特征点为
+        # keypoints[kp_offsets[k]:kp_offsets[k+1]]，第 p 个有效匹配对的匹配为
+        # matches[match_offsets[p]:match_offsets[p+1]]
+        keypoints = [load_features(path)[0] for path in paths]
+        valid = [pair for pair in pairs if len(results[pair])]
+        np.savez_compressed(
+            self.work_dir / "matches.npz",
+            images=np.array([p.name for p in images]),
+            keypoints=np.concatenate(keypoints or [np.empty((0, 4), np.float32)]),
+            kp_offsets=np.cumsum([0] + [len(kp) for kp in keypoints]),
+            pairs=np.array(valid, dtype=np.int32).reshape(-1, 2),
+            matches=np.concatenate(
+                [results[pair] for pair in valid] or [np.empty((0, 2), np.int32)]
+            ),
+            match_offsets=np.cumsum([0] + [len(results[pair]) for pair in valid]),
+        )
+        self.stats["images"] = len(images)
+        self.stats["pairs"] = len(pairs)
+        self.stats["valid_pairs"] = len(valid)
+        return self.stats
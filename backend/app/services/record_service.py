@@ -1,38 +1,244 @@
+import itertools
+import json
+import logging
+import queue
+import shutil
 import tempfile
+import threading
+import time
+from collections.abc import Callable
 from pathlib import Path
 
 import cv2
 
+from .h264_relay import H264Relay
+
+# 录制目录中的帧索引与已完成分段列表
+INDEX_FILE = "index.jsonl"
+SEGMENTS_FILE = "segments.jsonl"
+# 打开首个分段前用于测量帧率的帧数，测量失败时使用 DEFAULT_FPS
+FPS_PROBE_FRAMES = 15
+DEFAULT_FPS = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingError(RuntimeError):
+    """录制状态不允许当前操作：重复开始录制，或未在录制时写入帧"""
+
+
+def is_recording_dir(path: Path):
+    return (path / INDEX_FILE).exists()
+
+
+def read_recording_index(record_dir: Path):
+    """
+    读取分段录制的索引，返回 (帧列表, 已完成的分段列表)
+    帧记录包含全局序号 index、分段 segment、分段内帧号 frame、采集时间戳 timestamp
+    与采集时刻的遥测 telemetry；录制进行中时分段列表只包含已写完的分段
+    """
+    frames = []
+    segments = []
+    for name, rows in ((INDEX_FILE, frames), (SEGMENTS_FILE, segments)):
+        path = record_dir / name
+        if not path.exists():
+            continue
+        with open(path) as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # 最后一行可能尚未写完
+    return frames, segments
+
+
+def _frame_rate(start: float, end: float, frames: int):
+    """start 到 end 之间 frames 帧的平均帧率，无法测量时返回 0"""
+    return (frames - 1) / (end - start) if frames > 1 and end > start else 0.0
+
 
 class RecordService:
-    def __init__(self):
+    """
+    分段录制：每 segment_duration 秒切换到新的分段文件，
+    并在 index.jsonl 中记录每一帧的采集时间戳、所在分段、分段内帧号与遥测数据
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 60,
+        drop_oldest: bool = True,
+        relay: H264Relay | None = None,
+        segment_duration: float = 10.0,
+    ):
         self.is_recording = False
         self.writer: cv2.VideoWriter | None = None
         self.temp_dir = Path(tempfile.gettempdir()) / "dem"
         self.temp_dir.mkdir(exist_ok=True)
+        self.record_dir = self.temp_dir / "record"
+        self.segment_duration = segment_duration
+        # 采集时刻的遥测数据来源，由 DroneService 设置
+        self.telemetry: Callable[[], dict] | None = None
+        # 录制队列满时丢弃最旧的帧（drop_oldest）或当前帧
+        self.drop_oldest = drop_oldest
+        self.dropped_frames = 0
+        self._queue: queue.Queue[tuple[float, dict, cv2.Mat] | None] = queue.Queue(
+            maxsize=queue_size
+        )
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # 直通模式：由 relay 把原始 H.264 码流分段封装为 .mkv，不再逐帧编码
+        self.relay = relay
+        self._index = None
+        self._segments = None
+        self._frames = 0
+        self._segment = -1
+        self._segment_path: Path | None = None
+        self._segment_frames = 0
+        self._segment_start = 0.0
+        self._segment_end = 0.0
 
     def start_recording(self):
-        if not self.is_recording:
-            self.writer = cv2.VideoWriter(
-                str(self.temp_dir / "record.avi"),
-                cv2.VideoWriter_fourcc(*"XVID"), # type: ignore
-                30.0,
-                (960, 720),
+        if self.is_recording:
+            raise RecordingError("Recording is already in progress.")
+        shutil.rmtree(self.record_dir, ignore_errors=True)
+        self.record_dir.mkdir(parents=True)
+        self._index = open(self.record_dir / INDEX_FILE, "w")  # noqa: SIM115
+        self._segments = open(self.record_dir / SEGMENTS_FILE, "w")  # noqa: SIM115
+        self._frames = 0
+        self._segment = -1
+        self.dropped_frames = 0
+        if self.relay is not None:
+            self.relay.start_recording(
+                self.record_dir, self.segment_duration, self._on_relay_frame
             )
-            self.is_recording = True
         else:
-            raise Exception("Recording is already in progress.")
-        
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+        self.is_recording = True
+
     def stop_recording(self):
-        if self.is_recording:
+        if not self.is_recording:
+            return
+        if self.relay is not None:
+            self.relay.stop_recording()
+            self.is_recording = False
+        else:
+            with self._lock:
+                self.is_recording = False
+                self._queue.put(None)
+            if self._thread:
+                self._thread.join()
+                self._thread = None
             if self.writer:
                 self.writer.release()
                 self.writer = None
-            self.is_recording = False
+        self._finish_segment()
+        self._index.close()  # type: ignore[union-attr]
+        self._segments.close()  # type: ignore[union-attr]
+        self._index = self._segments = None
+
+    def _sample_telemetry(self):
+        if self.telemetry is None:
+            return {}
+        try:
+            return self.telemetry()
+        except (KeyError, OSError) as e:
+            logger.debug("Telemetry unavailable: %r", e)
+            return {}
+
+    def _index_frame(self, segment: int, path: Path, timestamp: float, telemetry: dict):
+        """记录一帧；分段号变化说明上一个分段已写完，追加到分段列表"""
+        if segment != self._segment:
+            self._finish_segment()
+            self._segment = segment
+            self._segment_path = path
+            self._segment_start = timestamp
+            self._segment_frames = 0
+        record = {
+            "index": self._frames,
+            "segment": segment,
+            "frame": self._segment_frames,
+            "timestamp": timestamp,
+            "telemetry": telemetry,
+        }
+        self._index.write(json.dumps(record) + "\n")  # type: ignore[union-attr]
+        self._frames += 1
+        self._segment_frames += 1
+        self._segment_end = timestamp
+
+    def _finish_segment(self):
+        if self._segment < 0:
+            return
+        record = {
+            "segment": self._segment,
+            "path": self._segment_path.name,  # type: ignore[union-attr]
+            "start": self._segment_start,
+            "end": self._segment_end,
+            "frames": self._segment_frames,
+        }
+        self._segments.write(json.dumps(record) + "\n")  # type: ignore[union-attr]
+        # 分段写完后刷新索引，下游可在飞行中处理已完成的分段
+        self._index.flush()  # type: ignore[union-attr]
+        self._segments.flush()  # type: ignore[union-attr]
+        self._segment = -1
+
+    def _on_relay_frame(self, segment: int, path: Path):
+        """直通模式下 relay 每封装一帧的回调"""
+        self._index_frame(segment, path, time.time(), self._sample_telemetry())
+
+    def _open_segment(self, segment: int, frame: cv2.Mat, fps: float):
+        if self.writer:
+            self.writer.release()
+        path = self.record_dir / f"segment_{segment:05d}.avi"
+        self.writer = cv2.VideoWriter(
+            str(path),
+            cv2.VideoWriter_fourcc(*"XVID"),  # type: ignore
+            fps,
+            (frame.shape[1], frame.shape[0]),
+        )
+        return path
+
+    def _write_loop(self):
+        """
+        录制线程：从队列中取帧写入当前分段，超过分段时长时切换到新分段
+        分段文件声明实测帧率：首个分段先缓存 FPS_PROBE_FRAMES 帧测量，
+        之后的分段沿用上一分段的平均帧率；每帧的准确时间戳记录在索引中
+        """
+        items = iter(self._queue.get, None)
+        probe = list(itertools.islice(items, FPS_PROBE_FRAMES))
+        fps = _frame_rate(probe[0][0], probe[-1][0], len(probe)) if probe else 0
+        segment = -1
+        path = None
+        start = end = 0.0
+        frames = 0
+        for timestamp, telemetry, frame in itertools.chain(probe, items):
+            if segment < 0 or timestamp - start >= self.segment_duration:
+                if frames > 1:
+                    fps = _frame_rate(start, end, frames)
+                segment += 1
+                path = self._open_segment(segment, frame, fps or DEFAULT_FPS)
+                start = timestamp
+                frames = 0
+            self.writer.write(frame)  # type: ignore[union-attr]
+            self._index_frame(segment, path, timestamp, telemetry)  # type: ignore[arg-type]
+            end = timestamp
+            frames += 1
 
     def record_frame(self, frame: cv2.Mat):
-        if self.is_recording and self.writer:
-            self.writer.write(frame)
-        else:
-            raise Exception("Recording is not in progress.")
-        
\ No newline at end of file
+        """将帧与采集时间戳、遥测放入录制队列，不阻塞调用方"""
+        if self.relay is not None:
+            return  # 直通模式下码流已原样录制
+        item = (time.time(), self._sample_telemetry(), frame)
+        with self._lock:
+            if not self.is_recording:
+                raise RecordingError("Recording is not in progress.")
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped_frames += 1
+                if self.drop_oldest:
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    self._queue.put_nowait(item)
@@ -1,57 +1,441 @@
 import asyncio
+import contextlib
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Literal, NamedTuple
 
 import cv2
 from fastapi import WebSocket
+from pydantic import BaseModel
 
 from .drone_service import DroneService
-from .record_service import RecordService
+from .h264_relay import H264Relay
+from .keyframe_service import KeyframeConfig, LiveKeyframeIngest
+from .record_service import RecordingError, RecordService
+
+logger = logging.getLogger(__name__)
+
+
+class StreamConfig(BaseModel):
+    # 是否根据发送延迟与丢帧自适应调整画质、分辨率与帧率
+    adaptive: bool = True
+    # 目标延迟（秒）：从采集到帧写入 websocket 的时间
+    target_latency: float = 0.2
+    # JPEG 质量范围，客户端可通过查询参数进一步降低上限；
+    # 上限为 OpenCV 的默认质量，网络通畅时与固定画质的推流相同
+    min_quality: int = 30
+    max_quality: int = 95
+    # 输出分辨率相对原始画面的最小缩放比例
+    min_scale: float = 0.5
+    # 帧率范围
+    min_fps: float = 10.0
+    max_fps: float = 30.0
+    # 画质档位数，档位 0 为最佳
+    levels: int = 6
+    # 两次调整之间的间隔（秒）
+    adjust_interval: float = 0.5
+
+
+class StreamProfile(NamedTuple):
+    """一个画质档位的编码参数，相同参数的客户端共享同一次编码"""
+
+    quality: int
+    scale: float
+
+
+class StreamClient:
+    """
+    单个视频订阅者：自有的小发送队列，落后时丢弃旧帧，并统计帧率与丢帧数
+    自适应模式下按发送延迟与丢帧升降画质档位：超出目标延迟立即降档，
+    连续若干个窗口延迟充裕才升档
+    """
+
+    QUEUE_SIZE = 2
+    # 升档前需要连续满足的低延迟窗口数
+    UPGRADE_WINDOWS = 4
+
+    def __init__(
+        self,
+        client_id: int,
+        websocket: WebSocket,
+        config: StreamConfig,
+        max_quality: int | None = None,
+    ):
+        self.id = client_id
+        self.websocket = websocket
+        self.config = config
+        self.max_quality = min(max_quality or config.max_quality, config.max_quality)
+        self.queue: asyncio.Queue[tuple[float, bytes]] = asyncio.Queue(
+            maxsize=self.QUEUE_SIZE
+        )
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.fps = 0.0
+        self.latency = 0.0
+        self.level = 0
+        self._last_sent: float | None = None
+        self._last_offered: float | None = None
+        self._window_start = time.monotonic()
+        self._window_dropped = 0
+        self._good_windows = 0
+        self.task: asyncio.Task | None = None
+
+    @property
+    def profile(self):
+        t = self.level / max(self.config.levels - 1, 1)
+        min_quality = min(self.config.min_quality, self.max_quality)
+        quality = round(self.max_quality - t * (self.max_quality - min_quality))
+        scale = round(1 - t * (1 - self.config.min_scale), 2)
+        return StreamProfile(quality, scale)
+
+    @property
+    def target_fps(self):
+        t = self.level / max(self.config.levels - 1, 1)
+        return self.config.max_fps - t * (self.config.max_fps - self.config.min_fps)
+
+    def offer(self, timestamp: float, encodings: dict[StreamProfile, bytes]):
+        data = encodings.get(self.profile)
+        if data is None:
+            return  # 档位刚变化，下一帧会按新档位编码
+        # 按本客户端的目标帧率跳帧（留 10% 余量吸收抖动）
+        if (
+            self._last_offered is not None
+            and timestamp - self._last_offered < 0.9 / self.target_fps
+        ):
+            return
+        self._last_offered = timestamp
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped_frames += 1
+            self._window_dropped += 1
+        self.queue.put_nowait((timestamp, data))
+
+    def _adjust(self, now: float):
+        """每个调整窗口结束时根据延迟与丢帧升降一档"""
+        if now - self._window_start < self.config.adjust_interval:
+            return
+        congested = (
+            self.latency > self.config.target_latency
+            or self._window_dropped > 0
+            or self.queue.qsize() > 0
+        )
+        if congested:
+            self.level = min(self.level + 1, self.config.levels - 1)
+            self._good_windows = 0
+        elif self.latency < self.config.target_latency / 2:
+            self._good_windows += 1
+            if self._good_windows >= self.UPGRADE_WINDOWS:
+                self.level = max(self.level - 1, 0)
+                self._good_windows = 0
+        self._window_start = now
+        self._window_dropped = 0
+
+    async def _send_loop(self):
+        while True:
+            timestamp, data = await self.queue.get()
+            await self.websocket.send_bytes(data)
+            now = time.monotonic()
+            # 发送间隔与延迟的指数滑动平均
+            latency = now - timestamp
+            self.latency = (
+                latency if self.sent_frames == 0 else 0.8 * self.latency + 0.2 * latency
+            )
+            if self._last_sent is not None:
+                instant = 1 / max(now - self._last_sent, 1e-6)
+                self.fps = instant if self.fps == 0 else 0.9 * self.fps + 0.1 * instant
+            self._last_sent = now
+            self.sent_frames += 1
+            if self.config.adaptive:
+                self._adjust(now)
+
+    async def _receive_loop(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    async def run(self):
+        """发送直到客户端断开或发送失败（视为断开）"""
+        tasks = [
+            asyncio.create_task(self._send_loop()),
+            asyncio.create_task(self._receive_loop()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            if not task.cancelled() and (error := task.exception()) is not None:
+                logger.info("Video client %d disconnected: %r", self.id, error)
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "fps": round(self.fps, 1),
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.dropped_frames,
+            "latency": round(self.latency, 3),
+            "level": self.level,
+            "quality": self.profile.quality,
+            "scale": self.profile.scale,
+            "target_fps": round(self.target_fps, 1),
+        }
+
+
+class H264StreamClient(StreamClient):
+    """
+    直通模式下接收原始 H.264 访问单元（Annex B）的订阅者
+    P 帧依赖前面的帧，落后时清空队列并等到下一个关键帧再继续发送
+    """
+
+    QUEUE_SIZE = 60
+
+    def __init__(self, client_id: int, websocket: WebSocket, config: StreamConfig):
+        super().__init__(client_id, websocket, config)
+        self._waiting_keyframe = True
+
+    def offer_packet(self, data: bytes, keyframe: bool, timestamp: float):
+        if self._waiting_keyframe and not keyframe:
+            return
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped_frames += 1
+            self._waiting_keyframe = True
+            if not keyframe:
+                return
+        self._waiting_keyframe = False
+        self.queue.put_nowait((timestamp, data))
+
+    def _adjust(self, now: float):
+        pass  # 直通码流不做画质调整
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "codec": "h264",
+            "fps": round(self.fps, 1),
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.dropped_frames,
+            "latency": round(self.latency, 3),
+        }
 
 
 class StreamService:
-    def __init__(self, drone_service: DroneService, record_service: RecordService):
+    # 采集线程轮询新帧的间隔（秒）
+    POLL_INTERVAL = 0.002
+
+    def __init__(
+        self,
+        drone_service: DroneService,
+        record_service: RecordService,
+        config: StreamConfig | None = None,
+        relay: H264Relay | None = None,
+    ):
         self.drone_service = drone_service
         self.record_service = record_service
+        self.config = config or StreamConfig()
+        # 直通模式：从 relay 取原始 H.264 码流，仅 JPEG 订阅者需要时才解码
+        self.relay = relay
+        # 可选的实时关键帧抽取，开启后即使没有 JPEG 订阅者也持续采集
+        self.ingest: LiveKeyframeIngest | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
         self.is_streaming = False
-        self.websocket: WebSocket | None = None
-        self.stream_task: asyncio.Task | None = None
+        self.clients: dict[int, StreamClient] = {}
+        self._next_client_id = 1
+        # 单槽缓冲：最新一帧 (序号, 采集时间戳, {编码参数: JPEG 字节})
+        self.latest: tuple[int, float, dict[StreamProfile, bytes]] | None = None
+        self._capture_thread: threading.Thread | None = None
 
-    async def connect_client(self, websocket: WebSocket):
-        if self.websocket is not None and self.websocket.client_state == 1:
-            await self.websocket.close()
+    @property
+    def passthrough(self):
+        return self.relay is not None
+
+    async def connect_client(
+        self,
+        websocket: WebSocket,
+        max_quality: int | None = None,
+        codec: Literal["jpeg", "h264"] = "jpeg",
+    ):
         await websocket.accept()
-        self.websocket = websocket
-        self.stream_task = asyncio.create_task(self.stream_frames())
-        self.is_streaming = True
+        self._loop = asyncio.get_running_loop()
+        if codec == "h264":
+            client = H264StreamClient(self._next_client_id, websocket, self.config)
+        else:
+            client = StreamClient(
+                self._next_client_id, websocket, self.config, max_quality
+            )
+        self._next_client_id += 1
+        self.clients[client.id] = client
+        self._update_sources()
+        client.task = asyncio.create_task(client.run())
+        return client
+
+    def _jpeg_clients(self):
+        return [
+            client
+            for client in list(self.clients.values())
+            if not isinstance(client, H264StreamClient)
+        ]
+
+    async def start_ingest(self, image_dir: Path, config: KeyframeConfig):
+        """开始实时关键帧抽取，写入 image_dir（会清空其中已有的图片）"""
+        await self.stop_ingest()
+        self._loop = asyncio.get_running_loop()
+        self.ingest = LiveKeyframeIngest(image_dir, config)
+        self._update_sources()
+
+    async def stop_ingest(self):
+        if self.ingest is None:
+            return
+        ingest = self.ingest
+        self.ingest = None
+        await asyncio.to_thread(ingest.stop)
+        await self._update_sources_and_wait()
+
+    def _update_sources(self):
+        """按订阅者类型与实时抽帧启停采集线程、直通解码与 H.264 转发"""
+        has_jpeg = bool(self._jpeg_clients())
+        has_h264 = len(self.clients) > len(self._jpeg_clients())
+        needs_frames = has_jpeg or self.ingest is not None
+        self.is_streaming = needs_frames
+        if self.relay is not None:
+            self.relay.decode = needs_frames
+            subscribed = self._on_packet in self.relay.subscribers
+            if has_h264 and not subscribed:
+                self.relay.subscribers.append(self._on_packet)
+            elif not has_h264 and subscribed:
+                self.relay.subscribers.remove(self._on_packet)
+            if needs_frames or has_h264:
+                self.relay.start()
+        if needs_frames:
+            self._start_capture()
+
+    async def _update_sources_and_wait(self):
+        """更新数据源，不再需要画面时等待采集线程退出"""
+        self._update_sources()
+        if not self.is_streaming and self._capture_thread is not None:
+            await asyncio.to_thread(self._capture_thread.join, 1)
+            self._capture_thread = None
+
+    def _on_packet(self, data: bytes, keyframe: bool, timestamp: float):
+        """relay 线程回调：把 H.264 访问单元交给事件循环分发"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(
+                self._broadcast_packet, data, keyframe, timestamp
+            )
+
+    def _broadcast_packet(self, data: bytes, keyframe: bool, timestamp: float):
+        for client in self.clients.values():
+            if isinstance(client, H264StreamClient):
+                client.offer_packet(data, keyframe, timestamp)
 
-    async def stream_frames(self):
-        frame_read = self.drone_service.drone.get_frame_read()
-        while self.is_streaming and self.websocket is not None:
+    def _frame_source(self):
+        if self.relay is not None:
+            return self.relay
+        return self.drone_service.drone.get_frame_read()
+
+    def _start_capture(self):
+        if self._capture_thread is not None and self._capture_thread.is_alive():
+            return
+        self.latest = None
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop,
+            args=(asyncio.get_running_loop(),),
+            daemon=True,
+        )
+        self._capture_thread.start()
+
+    def _broadcast(self):
+        """在事件循环中把最新一帧分发给所有订阅者，每个画质档位每帧只编码一次"""
+        if self.latest is None:
+            return
+        _, timestamp, encodings = self.latest
+        for client in self._jpeg_clients():
+            client.offer(timestamp, encodings)
+
+    def _encode(self, frame: cv2.typing.MatLike):
+        """按当前订阅者用到的画质档位编码，相同缩放比例只缩放一次"""
+        profiles = {client.profile for client in self._jpeg_clients()}
+        resized = {}
+        encodings = {}
+        for profile in profiles:
+            if profile.scale not in resized:
+                resized[profile.scale] = (
+                    frame
+                    if profile.scale >= 1
+                    else cv2.resize(
+                        frame,
+                        None,
+                        fx=profile.scale,
+                        fy=profile.scale,
+                        interpolation=cv2.INTER_AREA,
+                    )
+                )
+            _, buffer = cv2.imencode(
+                ".jpg",
+                resized[profile.scale],
+                [cv2.IMWRITE_JPEG_QUALITY, profile.quality],
+            )
+            encodings[profile] = buffer.tobytes()
+        return encodings
+
+    def _capture_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        采集线程：取新帧、转换一次颜色、送入录制队列并按各档位编码 JPEG
+        编码结果放入单槽缓冲，再通知事件循环分发
+        """
+        frame_read = self._frame_source()
+        last_frame = None
+        seq = 0
+        while self.is_streaming:
             frame = frame_read.frame
-            if frame is not None:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                if self.record_service.is_recording:
-                    self.record_service.record_frame(frame)
-                _, buffer = cv2.imencode(".jpg", frame)
-                try:
-                    await self.websocket.send_bytes(buffer.tobytes())
-                except Exception:
-                    self.is_streaming = False
-                    break
-                await asyncio.sleep(1 / 30)
-
-    async def disconnect_client(self):
-        if self.websocket is not None and self.websocket.client_state == 1:  # CONNECTED
-            self.is_streaming = False
-            await self.websocket.close()
-            self.websocket = None
-            if self.stream_task and not self.stream_task.done():
+            if frame is None or frame is last_frame:
+                time.sleep(self.POLL_INTERVAL)
+                continue
+            last_frame = frame
+            timestamp = time.monotonic()
+
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if self.record_service.is_recording:
                 try:
-                    await asyncio.wait_for(self.stream_task, timeout=1)
-                except (TimeoutError, asyncio.CancelledError):
-                    if not self.stream_task.cancelled():
-                        self.stream_task.cancel()
-                    try:
-                        await self.stream_task
-                    except asyncio.CancelledError:
-                        pass
-                self.stream_task = None
+                    self.record_service.record_frame(frame)
+                except RecordingError:
+                    logger.debug("Recording stopped while capturing a frame")
+            ingest = self.ingest
+            if ingest is not None:
+                ingest.offer(frame, timestamp)
+
+            # 按帧时间戳限制发送帧率（留 10% 余量吸收抖动），录制不受影响
+            min_interval = 0.9 / self.config.max_fps
+            if self.latest is not None and timestamp - self.latest[1] < min_interval:
+                continue
+            seq += 1
+            self.latest = (seq, timestamp, self._encode(frame))
+            loop.call_soon_threadsafe(self._broadcast)
+
+    def stats(self):
+        return {
+            "passthrough": self.passthrough,
+            "live_keyframes": None if self.ingest is None else self.ingest.count,
+            "clients": [client.stats() for client in self.clients.values()],
+            "dropped_recording_frames": self.record_service.dropped_frames,
+        }
+
+    async def disconnect_client(self, client: StreamClient):
+        self.clients.pop(client.id, None)
+        if client.task and not client.task.done():
+            client.task.cancel()
+            # run() 已处理发送与接收的异常，这里只会收到取消
+            with contextlib.suppress(asyncio.CancelledError):
+                await client.task
+        if client.websocket.client_state == 1:  # CONNECTED
+            try:
+                await client.websocket.close()
+            except RuntimeError as e:
+                logger.debug("Video client %d already closed: %r", client.id, e)
+        # 没有 JPEG 订阅者且未实时抽帧时停止采集
+        await self._update_sources_and_wait()